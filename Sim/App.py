@@ -1,12 +1,16 @@
 from __future__ import annotations
 import math
+import os
 import pygame
 import random
+import numpy as np
 from geometry.geometry import Point, Vector, Rectangle
 import time
 from Sim import *
+from Snapshot import save_snapshot, load_snapshot
+from LOD import SegmentLOD
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Union
 pygame.init()
 
 
@@ -16,12 +20,20 @@ class App:
 
     SCROLL_FACTOR = 1.05
     MOVE_FACTOR = 0.01  # Percent of camera's world width to move
+    QUICKSAVE_PATH = "quicksave.snap"
+    LOD_PIXELS = 2  # Walls and pipes are simplified by up to this many pixels when zoomed out
 
     def __init__(self, screen_size_percent: tuple[float, float],
-                 walls: list[Vector], pipes: list[Vector], drone_start: Point):
-        self.sim = Sim(walls, pipes, drone_start)
+                 walls: Union[list[Vector], np.ndarray], pipes: Union[list[Vector], np.ndarray], drone_start: Point,
+                 gas_mode=Sim.GAS_PARTICLES):
+        self.sim = Sim(walls, pipes, drone_start, gas_mode)
         self.running = True
 
+        # Walls and pipes never change, so simplified versions for zooming out are built up front
+        self.wall_lod = SegmentLOD(self.sim.walls)
+        self.pipe_lod = SegmentLOD(np.array([(p.vec.start.x, p.vec.start.y, p.vec.end.x, p.vec.end.y)
+                                             for p in self.sim.pipes]))
+
         self.sim_speed = 1.0
 
         # Pygame / drawing
@@ -55,29 +67,88 @@ class App:
             self.events = pygame.event.get()
             self.handle_events()
 
+            prof = self.sim.profiler
             # Update sim
-            self.sim.update(t_delta * self.sim_speed)
+            with prof.phase("sim_update"):
+                self.sim.update(t_delta * self.sim_speed)
             # Render sim
-            self.render_sim()
+            with prof.phase("render"):
+                self.render_sim()
 
-            # Refresh screen
-            pygame.display.update()
+                # Refresh screen
+                pygame.display.update()
 
     def render_sim(self) -> None:
         """Render sim components onto screen"""
-        for wall in self.sim.walls:
-            self.draw_vector(wall.vec, (0, 255, 0), endpt_rad=4)
+        if self.sim.gas_field is not None:
+            self.draw_gas_field(self.sim.gas_field)
 
-        for pipe in self.sim.pipes:
-            self.draw_vector(pipe.vec, (255, 0, 0), endpt_rad=4)
+        self.draw_segments(self.wall_lod, (0, 255, 0))
+        self.draw_segments(self.pipe_lod, (255, 0, 0))
 
         for leak in self.sim.leaks:
             self.draw_circle(leak.emitter_loc, (255, 255, 0), 0.1, 2)
-            for p in leak.particles:
-                self.draw_circle(Point(*p[0]), (255, 255, 0), 0.02)
+            for x, y in leak.particle_pos:
+                self.draw_circle(Point(x, y), (255, 255, 0), 0.02)
 
         self.draw_circle(self.sim.drone.pos, (0, 0, 255), self.sim.drone.radius)
 
+    def draw_gas_field(self, field: GasField) -> None:
+        """Draw the concentration grid as a yellow overlay, saturating at the detection threshold.
+        Only the cells in view are read, and each screen pixel shows the highest concentration of
+        the cells under it, so the image is never bigger than the screen and thin plumes stay
+        visible when zoomed out"""
+        width, height = self.screen.get_size()
+        meters_per_pixel = self.camera.width() / width
+        top_left = self.camera.top_left()
+
+        def pixel_cells(start: float, origin: float, pixels: int, count: int) -> tuple[int, np.ndarray, int]:
+            """Return the first pixel over the grid along one axis, the cell at the start of each
+            pixel over the grid from there, and the cell just past the last pixel's end"""
+            edges = np.floor((start + np.arange(pixels + 1) * meters_per_pixel - origin) / field.cell_size).astype(int)
+            inside = np.flatnonzero((edges[1:] > 0) & (edges[:-1] < count))
+            if len(inside) == 0:
+                return 0, inside, 0
+            cells = np.clip(edges[inside[0]:inside[-1] + 1], 0, count - 1)
+            return int(inside[0]), cells, min(int(edges[inside[-1] + 1]) + 1, count)
+
+        x0, col_starts, col_end = pixel_cells(top_left.x, field.bounds.left, width, field.cols)
+        y0, row_starts, row_end = pixel_cells(top_left.y, field.bounds.top, height, field.rows)
+        if len(col_starts) == 0 or len(row_starts) == 0:
+            return
+
+        view = field.concentration[row_starts[0]:row_end, col_starts[0]:col_end]
+        view = np.maximum.reduceat(view, row_starts - row_starts[0], axis=0)
+        view = np.maximum.reduceat(view, col_starts - col_starts[0], axis=1)
+        intensity = np.clip(view / GasField.DETECTION_THRESHOLD, 0.0, 1.0) * 255
+        pixels = np.zeros((len(col_starts), len(row_starts), 3), dtype=np.uint8)
+        pixels[..., 0] = intensity.T
+        pixels[..., 1] = intensity.T
+        self.screen.blit(pygame.surfarray.make_surface(pixels), (x0, y0))
+
+    def draw_segments(self, lod: SegmentLOD, color: tuple[int, int, int]) -> None:
+        """Draw the segments of lod inside the camera view, at the coarsest level that still looks
+        right at the current zoom. Endpoints are only marked when drawing the full detail"""
+        width = self.screen.get_width()
+        meters_per_pixel = self.camera.width() / width
+        # Full detail, endpoints included, until zoomed out past LOD_PIXELS pixels per BASE_TOLERANCE,
+        # which covers the default 25m wide view on common screens
+        if meters_per_pixel <= SegmentLOD.BASE_TOLERANCE * App.LOD_PIXELS:
+            level = 0
+        else:
+            level = lod.level_for(meters_per_pixel * App.LOD_PIXELS)
+        top_left = self.camera.top_left()
+        segments = lod.visible(level, top_left.x, top_left.y, top_left.x + self.camera.width(),
+                               top_left.y + self.screen.get_height() * meters_per_pixel)
+
+        starts = self.camera.convert_array(segments[:, :2], width).tolist()
+        ends = self.camera.convert_array(segments[:, 2:], width).tolist()
+        for start, end in zip(starts, ends):
+            pygame.draw.line(self.screen, color, start, end)
+        if level == 0:
+            for point in starts + ends:
+                pygame.draw.circle(self.screen, color, point, 4, 1)
+
     def draw_vector(self, vec: Vector, color: tuple[int, int, int], endpt_rad: Optional[int] = None) -> None:
         """Given a vector in sim-world coordinates, convert and draw the vector relative
         to App camera"""
@@ -119,6 +190,10 @@ class App:
                     self.sim.apply_force_drone(-10.0, 0.0)
                 elif event.key == pygame.K_RIGHT:
                     self.sim.apply_force_drone(10.0, 0.0)
+                elif event.key == pygame.K_F5:
+                    save_snapshot(self.sim, App.QUICKSAVE_PATH)
+                elif event.key == pygame.K_F9 and os.path.exists(App.QUICKSAVE_PATH):
+                    load_snapshot(self.sim, App.QUICKSAVE_PATH)
 
         # Camera pan
         p = pygame.key.get_pressed()
@@ -173,6 +248,11 @@ class Camera:
         return Point(self.scale_quantity(pt.x - top_left.x, pixel_width),
                      self.scale_quantity(pt.y - top_left.y, pixel_width))
 
+    def convert_array(self, pts: np.ndarray, pixel_width: int) -> np.ndarray:
+        """convert_point for an (n, 2) array of points at once"""
+        top_left = self.top_left()
+        return self.scale_quantity(pts - (top_left.x, top_left.y), pixel_width)
+
     def scale_quantity(self, value: float, pixel_width: int) -> float:
         """Given a pixel width of screen and an in-world measurement value,
         scale the measurement to be relative to pixel_width"""
@@ -0,0 +1,94 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Callable, TYPE_CHECKING
+from geometry.geometry import Point, Vector
+if TYPE_CHECKING:
+    from Sim import Leak
+
+
+@dataclass
+class LeakCreated:
+    """A leak sprang, e.g. from a pipe"""
+    time: float
+    leak: Leak
+
+
+@dataclass
+class GasDetected:
+    """The drone sensed gas from a leak nobody had noticed yet"""
+    time: float
+    leak: Leak
+    drone_pos: Point
+
+
+@dataclass
+class WallCollision:
+    """The drone hit a wall"""
+    time: float
+    wall: Vector
+    normal: Point  # Unit normal of the wall, pointing toward the drone
+    velocity: Point  # Drone velocity just before the impact
+
+
+@dataclass
+class ParticlesExpired:
+    """Gas particles of a leak outlived their lifetime this tick"""
+    time: float
+    leak: Leak
+    count: int
+
+
+@dataclass
+class LeakRepaired:
+    """A crew repaired a leak, it stops emitting"""
+    time: float
+    leak: Leak
+
+
+@dataclass
+class LeakRetired:
+    """A repaired leak's gas is gone and it was removed from the sim"""
+    time: float
+    leak: Leak
+
+
+class EventBus:
+    """Lets outside code subscribe to sim events without touching the sim.
+
+    Events raised during a tick are queued and handed out together at the end of it, each
+    subscriber getting one list per tick of all events of its type. Code raising an event checks
+    wants() first, so no event object is ever built for a type nobody subscribed to
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._queued = {}
+
+    def subscribe(self, event_type: type, callback: Callable[[list], None]) -> None:
+        """Call callback at the end of every tick with events of event_type, if there were any"""
+        self._subscribers.setdefault(event_type, []).append(callback)
+
+    def unsubscribe(self, event_type: type, callback: Callable[[list], None]) -> None:
+        callbacks = self._subscribers.get(event_type, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._subscribers.pop(event_type, None)
+            self._queued.pop(event_type, None)
+
+    def wants(self, event_type: type) -> bool:
+        """Return whether anyone is subscribed to event_type"""
+        return event_type in self._subscribers
+
+    def emit(self, event) -> None:
+        """Queue event for the end of the tick. Callers should check wants() before building it"""
+        self._queued.setdefault(type(event), []).append(event)
+
+    def dispatch(self) -> None:
+        """Hand queued events to their subscribers"""
+        if not self._queued:
+            return
+        queued, self._queued = self._queued, {}
+        for event_type, events in queued.items():
+            for callback in list(self._subscribers.get(event_type, [])):
+                callback(events)
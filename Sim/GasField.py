@@ -0,0 +1,204 @@
+from __future__ import annotations
+import math
+from typing import Optional
+import numpy as np
+from geometry.geometry import Point, Rectangle
+from geometry.helpers import segments_intersecting_array
+
+
+class GasField:
+    """Gas dispersion modelled as a 2D concentration grid laid over the scene bounds.
+    Alternative to simulating individual particles: the cost of an update depends only on
+    the grid resolution, not on how many leaks there are or how fast they emit
+
+    Instance Attributes
+        - bounds: Rectangle in sim-world coordinates covered by the grid
+        - cell_size: Side length of a grid cell (m)
+        - concentration: (rows, cols) array of gas concentration per cell (units/m^2)
+        - open_x: (rows, cols - 1) array, 1.0 where gas may cross between horizontal neighbours, 0.0 at walls
+        - open_y: (rows - 1, cols) array, 1.0 where gas may cross between vertical neighbours, 0.0 at walls
+        - wind: Point indicating constant air flow x,y (m/s) advecting the gas
+    """
+    bounds: Rectangle
+    cell_size: float
+    concentration: np.ndarray
+    open_x: np.ndarray
+    open_y: np.ndarray
+    wind: Point
+
+    DIFFUSIVITY = 0.05  # m^2/s
+    DECAY_RATE = 0.05  # Fraction of gas vented per second
+    EMISSION_RATE = 1.0  # Units of gas emitted by one leak per second
+    DETECTION_THRESHOLD = 0.5  # units/m^2 a drone needs to sense to count as a detection
+    MARGIN = 1.0  # Extra space (m) around the scene covered by the grid
+    CELL_SIZE = 0.1  # Default cell side (m), coarser for scenes that would need more than MAX_CELLS
+    MAX_CELLS = 2000000  # Most cells in a grid, each grid sized array takes 16MB at this size
+    # Gas above the threshold is only blamed on leaks this close (m). In still air it reaches about 2m
+    # from a lone leak
+    ATTRIBUTION_RADIUS = 5.0
+
+    def __init__(self, bounds: Rectangle, walls: np.ndarray, cell_size=CELL_SIZE, wind=Point(0.0, 0.0)):
+        self.bounds = bounds
+        self.cell_size = cell_size
+        self.wind = wind
+
+        self.cols, self.rows = GasField.grid_shape(bounds.width, bounds.height, cell_size)
+        if self.rows * self.cols > GasField.MAX_CELLS:
+            raise ValueError("A {:.0f}x{:.0f}m gas field with {}m cells needs {} cells, more than MAX_CELLS ({}). "
+                             "Use cells of at least {:.3g}m".format(
+                                 bounds.width, bounds.height, cell_size, self.rows * self.cols, GasField.MAX_CELLS,
+                                 GasField.fitting_cell_size(bounds.width, bounds.height)))
+        self.concentration = np.zeros((self.rows, self.cols))
+
+        self.open_x = np.ones((self.rows, self.cols - 1))
+        self.open_y = np.ones((self.rows - 1, self.cols))
+        for wall in walls:
+            self._add_barrier(wall[:2], wall[2:])
+
+        # Leaks acting as sources, with their flat cell indices cached for scatter-adds
+        self.sources = []
+        self._source_cells = np.zeros(0, dtype=np.intp)
+
+    @staticmethod
+    def grid_shape(width: float, height: float, cell_size: float) -> tuple[int, int]:
+        """Return cols, rows of a grid of cell_size cells covering width by height"""
+        return max(1, math.ceil(width / cell_size)), max(1, math.ceil(height / cell_size))
+
+    @staticmethod
+    def fitting_cell_size(width: float, height: float) -> float:
+        """Return the finest cell size, no finer than CELL_SIZE, that covers width by height in MAX_CELLS"""
+        cell_size = max(GasField.CELL_SIZE, math.sqrt(width * height / GasField.MAX_CELLS))
+        while math.prod(GasField.grid_shape(width, height, cell_size)) > GasField.MAX_CELLS:
+            cell_size *= 1.01
+        return cell_size
+
+    @staticmethod
+    def from_scene(walls: np.ndarray, pipes: np.ndarray, drone_start: Point,
+                   cell_size: Optional[float] = None) -> GasField:
+        """Return a field whose grid covers every wall, pipe (as (n, 4) segment arrays) and the drone start,
+        padded by MARGIN. Without a cell_size, cells are CELL_SIZE or as fine as MAX_CELLS allows"""
+        pts = np.concatenate((walls.reshape(-1, 2), pipes.reshape(-1, 2), [(drone_start.x, drone_start.y)]))
+        left, top = pts.min(axis=0) - GasField.MARGIN
+        right, bottom = pts.max(axis=0) + GasField.MARGIN
+        width, height = float(right - left), float(bottom - top)
+        if cell_size is None:
+            cell_size = GasField.fitting_cell_size(width, height)
+        return GasField(Rectangle(left=float(left), top=float(top), width=width, height=height),
+                        walls, cell_size)
+
+    def cell_center(self, row: np.ndarray, col: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return x,y sim-world coordinates of the given cell centers"""
+        return (self.bounds.left + (col + 0.5) * self.cell_size,
+                self.bounds.top + (row + 0.5) * self.cell_size)
+
+    def _cell_range(self, low: float, high: float, origin: float, count: int) -> np.ndarray:
+        """Return indices of cells along one axis whose centers could be connected across [low, high]"""
+        first = max(0, math.floor((low - origin) / self.cell_size - 0.5))
+        last = min(count - 1, math.ceil((high - origin) / self.cell_size - 0.5))
+        return np.arange(first, last + 1)
+
+    def _add_barrier(self, a: np.ndarray, b: np.ndarray) -> None:
+        """Close every cell face whose center-to-center connection crosses the wall from a to b"""
+        rows = self._cell_range(min(a[1], b[1]), max(a[1], b[1]), self.bounds.top, self.rows)
+        cols = self._cell_range(min(a[0], b[0]), max(a[0], b[0]), self.bounds.left, self.cols)
+
+        for open_faces, d_row, d_col in ((self.open_x, 0, 1), (self.open_y, 1, 0)):
+            r = rows[rows < open_faces.shape[0]]
+            c = cols[cols < open_faces.shape[1]]
+            if r.size == 0 or c.size == 0:
+                continue
+            rr, cc = np.meshgrid(r, c, indexing="ij")
+            start = np.stack(self.cell_center(rr, cc), axis=-1)
+            end = np.stack(self.cell_center(rr + d_row, cc + d_col), axis=-1)
+            crossed = segments_intersecting_array(start, end, a, b)
+            open_faces[rr[crossed], cc[crossed]] = 0.0
+
+    def add_source(self, leak) -> None:
+        """Start treating the leak's emitter location as a gas source"""
+        self.sources.append(leak)
+        self._refresh_sources()
+
+    def remove_source(self, leak) -> None:
+        """Stop emitting gas from the leak, gas already in the field remains"""
+        self.sources.remove(leak)
+        self._refresh_sources()
+
+    def clear_sources(self) -> None:
+        """Stop emitting gas from every leak, gas already in the field remains"""
+        self.sources = []
+        self._refresh_sources()
+
+    def _refresh_sources(self) -> None:
+        cells = []
+        for leak in self.sources:
+            col = math.floor((leak.emitter_loc.x - self.bounds.left) / self.cell_size)
+            row = math.floor((leak.emitter_loc.y - self.bounds.top) / self.cell_size)
+            if 0 <= row < self.rows and 0 <= col < self.cols:
+                cells.append(row * self.cols + col)
+        self._source_cells = np.array(cells, dtype=np.intp)
+
+    def max_stable_step(self) -> float:
+        """Return the largest time step (s) the explicit stencil can take without blowing up"""
+        h = self.cell_size
+        rate = 4 * GasField.DIFFUSIVITY / h ** 2 + (abs(self.wind.x) + abs(self.wind.y)) / h
+        return 0.9 / rate
+
+    def update(self, time_delta: float) -> None:
+        """Advance diffusion, advection, emission and venting by time_delta, split into stable substeps"""
+        if time_delta <= 0:
+            return
+        steps = math.ceil(time_delta / self.max_stable_step())
+        for _ in range(steps):
+            self._step(time_delta / steps)
+
+    def _step(self, dt: float) -> None:
+        c = self.concentration
+        h = self.cell_size
+
+        # Flux across each face (units per m per s), positive towards increasing index
+        flux_x = -GasField.DIFFUSIVITY * (c[:, 1:] - c[:, :-1]) / h
+        flux_y = -GasField.DIFFUSIVITY * (c[1:, :] - c[:-1, :]) / h
+
+        # First order upwind advection
+        if self.wind.x:
+            flux_x += self.wind.x * (c[:, :-1] if self.wind.x > 0 else c[:, 1:])
+        if self.wind.y:
+            flux_y += self.wind.y * (c[:-1, :] if self.wind.y > 0 else c[1:, :])
+
+        # Walls block all transport
+        flux_x *= self.open_x
+        flux_y *= self.open_y
+
+        scale = dt / h
+        c[:, :-1] -= flux_x * scale
+        c[:, 1:] += flux_x * scale
+        c[:-1, :] -= flux_y * scale
+        c[1:, :] += flux_y * scale
+
+        # Sources deposit into their cell, several leaks can share a cell
+        np.add.at(c.reshape(-1), self._source_cells, GasField.EMISSION_RATE * dt / h ** 2)
+
+        c *= math.exp(-GasField.DECAY_RATE * dt)
+
+    def sample(self, point: Point) -> float:
+        """Return concentration at point, bilinearly interpolated between cell centers. Zero outside the grid"""
+        fx = (point.x - self.bounds.left) / self.cell_size - 0.5
+        fy = (point.y - self.bounds.top) / self.cell_size - 0.5
+        if not (-0.5 <= fx <= self.cols - 0.5 and -0.5 <= fy <= self.rows - 0.5):
+            return 0.0
+
+        col0 = min(max(math.floor(fx), 0), self.cols - 1)
+        row0 = min(max(math.floor(fy), 0), self.rows - 1)
+        col1 = min(col0 + 1, self.cols - 1)
+        row1 = min(row0 + 1, self.rows - 1)
+        tx = min(max(fx - col0, 0.0), 1.0)
+        ty = min(max(fy - row0, 0.0), 1.0)
+
+        c = self.concentration
+        top = c[row0, col0] * (1 - tx) + c[row0, col1] * tx
+        bot = c[row1, col0] * (1 - tx) + c[row1, col1] * tx
+        return float(top * (1 - ty) + bot * ty)
+
+    def is_detected(self, point: Point) -> bool:
+        """Return if a sensor at point reads a concentration above the detection threshold"""
+        return self.sample(point) >= GasField.DETECTION_THRESHOLD
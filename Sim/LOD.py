@@ -0,0 +1,107 @@
+from __future__ import annotations
+import math
+import numpy as np
+
+
+class SegmentLOD:
+    """Static line segments (walls or pipes) precomputed at several levels of detail, so that a
+    zoomed out view draws a handful of long lines instead of every segment.
+
+    Level 0 is the segments as given. Each further level doubles a tolerance, starting at
+    BASE_TOLERANCE: segments lying on the same line (within the tolerance) that overlap or have
+    gaps under the tolerance, such as a wall broken up by doorways, are merged into one, and
+    segments shorter than the tolerance are dropped. Drawn at a zoom where the tolerance is no more
+    than a pixel, a level looks the same as the full geometry
+
+    Instance Attributes
+        - levels: (n, 4) arrays of x1, y1, x2, y2 segments, finest first
+        - tolerances: Tolerance (m) of each level, 0 for the exact level 0
+    """
+    levels: list[np.ndarray]
+    tolerances: list[float]
+
+    BASE_TOLERANCE = 0.02  # m, tolerance of level 1
+    ANGLE_TOLERANCE = math.radians(0.5)  # Segments closer than this in direction may be merged
+
+    def __init__(self, segments: np.ndarray):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self.levels = [segments]
+        self.tolerances = [0.0]
+        if len(segments) == 0:
+            return
+
+        extent = max(np.ptp(segments[:, [0, 2]]), np.ptp(segments[:, [1, 3]]))
+        tolerance = SegmentLOD.BASE_TOLERANCE
+        while len(self.levels[-1]) > 1 and tolerance <= extent:
+            self.levels.append(SegmentLOD.simplify(self.levels[-1], tolerance))
+            self.tolerances.append(tolerance)
+            tolerance *= 2
+
+    @staticmethod
+    def simplify(segments: np.ndarray, tolerance: float) -> np.ndarray:
+        """Return segments with nearly collinear runs merged and ones shorter than tolerance dropped.
+        Segments that are not merged with anything keep their endpoints"""
+        delta = segments[:, 2:] - segments[:, :2]
+        length = np.hypot(delta[:, 0], delta[:, 1])
+        keep = length >= tolerance
+        bins = round(math.pi / SegmentLOD.ANGLE_TOLERANCE)
+        direction = np.arctan2(delta[:, 1], delta[:, 0]) % math.pi
+        angle_bin = np.round(direction / SegmentLOD.ANGLE_TOLERANCE) % bins
+        angle = angle_bin * SegmentLOD.ANGLE_TOLERANCE
+        # Merged runs are rebuilt along their binned direction, so only segments that stay within
+        # half the tolerance of it over their length may take part
+        angle_error = np.abs((direction - angle + math.pi / 2) % math.pi - math.pi / 2)
+        mergeable = length * np.sin(angle_error) <= tolerance / 2
+        alone = segments[keep & ~mergeable]
+
+        segments, angle_bin, angle = segments[mergeable], angle_bin[mergeable], angle[mergeable]
+        if len(segments) == 0:
+            return alone
+        along = np.stack((np.cos(angle), np.sin(angle)), axis=1)
+        normal = np.stack((-along[:, 1], along[:, 0]), axis=1)
+
+        # Position of each segment on its line, and of its line, in the line's own direction
+        mid = (segments[:, :2] + segments[:, 2:]) / 2
+        offset = np.einsum("ij,ij->i", mid, normal)
+        offset_bin = np.round(offset / tolerance)
+        t1 = np.einsum("ij,ij->i", segments[:, :2], along)
+        t2 = np.einsum("ij,ij->i", segments[:, 2:], along)
+        low, high = np.minimum(t1, t2), np.maximum(t1, t2)
+
+        # Sort by line, then along it, and start a new run wherever a line starts or a gap opens
+        order = np.lexsort((low, offset_bin, angle_bin))
+        segments, angle_bin, offset_bin, offset, low, high = \
+            segments[order], angle_bin[order], offset_bin[order], offset[order], low[order], high[order]
+        along, normal = along[order], normal[order]
+        new_line = np.ones(len(order), dtype=bool)
+        new_line[1:] = (angle_bin[1:] != angle_bin[:-1]) | (offset_bin[1:] != offset_bin[:-1])
+        # Shifting every line far past the previous makes one running max work for all lines at once
+        shift = np.cumsum(new_line) * (high.max() - low.min() + 4 * tolerance)
+        reach = np.maximum.accumulate(high + shift)
+        new_run = new_line.copy()
+        new_run[1:] |= low[1:] + shift[1:] > reach[:-1] + tolerance
+        starts = np.flatnonzero(new_run)
+        members = np.diff(np.append(starts, len(order)))
+
+        run_low = np.minimum.reduceat(low, starts)
+        run_high = np.maximum.reduceat(high, starts)
+        run_offset = (np.add.reduceat(offset, starts) / members)[:, None]
+        run_along, run_normal = along[starts], normal[starts]
+        merged = np.hstack((run_along * run_low[:, None] + run_normal * run_offset,
+                            run_along * run_high[:, None] + run_normal * run_offset))
+        single = members == 1
+        merged[single] = segments[starts[single]]
+        return np.concatenate((alone, merged[run_high - run_low >= tolerance]))
+
+    def level_for(self, meters_per_pixel: float) -> int:
+        """Return the coarsest level whose tolerance is at most a pixel"""
+        return int(np.searchsorted(self.tolerances, meters_per_pixel, side="right")) - 1
+
+    def visible(self, level: int, left: float, top: float, right: float, bottom: float) -> np.ndarray:
+        """Return the segments of level whose bounding boxes overlap the given view"""
+        segments = self.levels[level]
+        inside = (np.minimum(segments[:, 0], segments[:, 2]) <= right) & \
+            (np.maximum(segments[:, 0], segments[:, 2]) >= left) & \
+            (np.minimum(segments[:, 1], segments[:, 3]) <= bottom) & \
+            (np.maximum(segments[:, 1], segments[:, 3]) >= top)
+        return segments[inside]
@@ -0,0 +1,189 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import uuid
+from typing import Optional
+import requests
+
+
+class Outbox:
+    """Durable queue of leak notifications. Every notification is appended to a file on disk
+    before anything is sent, and a background sender posts them to the server in batches,
+    dropping them only once the server has acknowledged them. If the server is down the sim
+    carries on and the sender retries with backoff. Unsent notifications are picked up from the
+    file again after a crash or restart.
+
+    Files:
+        - path: One JSON line per notification, {"seq": n, "location": [x, y]}
+        - path + ".ack": JSON {"source": id, "seq": n, "offset": b}. seq is the last notification the
+          server acknowledged and offset the byte offset in path just past it. source identifies this
+          outbox to the server, so a batch resent after a crash is not added twice
+
+    Pending notifications are read back from the file, never kept in memory, so an outage of
+    any length only grows the file. Once everything is acknowledged the file is truncated
+
+    Instance Attributes
+        - path: Outbox file
+        - url: Server endpoint accepting batches
+        - source: Unique id of this outbox
+    """
+    path: str
+    url: str
+    source: str
+
+    BATCH_SIZE = 50
+    TIMEOUT = 5.0  # Seconds to wait for the server to answer a batch
+    RETRY_DELAY = 0.5  # Seconds before retrying after a failure, doubled per failure in a row
+    MAX_RETRY_DELAY = 30.0
+
+    def __init__(self, path: str, url: str, start=True):
+        self.path = path
+        self.url = url
+        self._lock = threading.Lock()  # Guards the outbox file and ack state
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._thread = None
+
+        ack = {"source": uuid.uuid4().hex, "seq": 0, "offset": 0}
+        if os.path.exists(self._ack_path()):
+            with open(self._ack_path()) as file:
+                ack = json.load(file)
+        self.source = ack["source"]
+        self._acked_seq = ack["seq"]
+        self._acked_offset = ack["offset"]
+
+        # Continue numbering after the last notification written, sent or not
+        self._next_seq = self._acked_seq + 1
+        self._size = 0
+        if os.path.exists(path):
+            self._size = self._recover()
+        self._write_ack()
+        self._file = open(path, "ab")
+
+        if start:
+            self.start()
+
+    def _ack_path(self) -> str:
+        return self.path + ".ack"
+
+    def _recover(self) -> int:
+        """Find the last sequence number in the file, dropping a partial line left by a crash.
+        Return the size of the file"""
+        if self._acked_offset > os.path.getsize(self.path):
+            # File was cut short outside the outbox, nothing in it can be trusted to be unsent
+            self._acked_offset = 0
+        with open(self.path, "rb") as file:
+            file.seek(self._acked_offset)
+            good_end = self._acked_offset
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                self._next_seq = json.loads(line)["seq"] + 1
+                good_end += len(line)
+        os.truncate(self.path, good_end)
+        return good_end
+
+    def _write_ack(self) -> None:
+        """Persist ack state, replacing the file atomically so a crash never leaves it half written"""
+        tmp = self._ack_path() + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump({"source": self.source, "seq": self._acked_seq, "offset": self._acked_offset}, file)
+        os.replace(tmp, self._ack_path())
+
+    def append(self, location: list[float]) -> int:
+        """Durably queue a notification of a leak at location and return its sequence number.
+        Only writes to the local file, never blocks on the network"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            line = (json.dumps({"seq": seq, "location": location}) + "\n").encode()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._wakeup.notify()
+        return seq
+
+    def pending(self) -> int:
+        """Return how many notifications are waiting for acknowledgement"""
+        with self._lock:
+            return self._next_seq - 1 - self._acked_seq
+
+    def _read_batch(self) -> tuple[list[dict], int]:
+        """Return up to BATCH_SIZE unacknowledged notifications and the offset just past them"""
+        batch = []
+        with self._lock:
+            offset, size = self._acked_offset, self._size
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            while len(batch) < Outbox.BATCH_SIZE and offset < size:
+                line = file.readline()
+                offset += len(line)
+                batch.append(json.loads(line))
+        return batch, offset
+
+    def _acknowledge(self, seq: int, offset: int) -> None:
+        with self._lock:
+            self._acked_seq, self._acked_offset = seq, offset
+            if self._acked_offset != self._size:
+                self._write_ack()
+                return
+            # Everything is delivered, start the file over so it doesn't grow forever. The ack is
+            # saved first: a crash before the truncate only resends lines the server already has,
+            # which it drops, while truncating first would restart numbering at an acked seq
+            self._acked_offset = 0
+            self._write_ack()
+            self._file.truncate(0)
+            self._size = 0
+
+    def send_batch(self) -> Optional[int]:
+        """Send one batch of pending notifications. Return how many the server acknowledged, or
+        None if the batch failed to send"""
+        batch, end = self._read_batch()
+        if not batch:
+            return 0
+        try:
+            res = requests.post(self.url, json={"source": self.source, "pings": batch}, timeout=Outbox.TIMEOUT)
+            res.raise_for_status()
+            acked = set(res.json()["acked"])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print("Outbox send failed:", e)
+            return None
+
+        if all(entry["seq"] in acked for entry in batch):
+            self._acknowledge(batch[-1]["seq"], end)
+            return len(batch)
+        return None
+
+    def _run(self) -> None:
+        delay = Outbox.RETRY_DELAY
+        while True:
+            with self._lock:
+                while not self._stopping and self._next_seq - 1 == self._acked_seq:
+                    self._wakeup.wait()
+                if self._stopping:
+                    return
+            if self.send_batch() is None:
+                # Back off, but wake early if asked to stop
+                with self._lock:
+                    self._wakeup.wait_for(lambda: self._stopping, timeout=delay)
+                delay = min(delay * 2, Outbox.MAX_RETRY_DELAY)
+            else:
+                delay = Outbox.RETRY_DELAY
+
+    def start(self) -> None:
+        """Start the background sender"""
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background sender. Unsent notifications stay in the file for next time"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._file.close()
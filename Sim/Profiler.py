@@ -0,0 +1,127 @@
+from __future__ import annotations
+import json
+import threading
+import time
+from typing import Optional
+
+
+class _Phase:
+    """Times one run of a named phase for a Profiler"""
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullPhase:
+    """Stand-in returned by a disabled Profiler, does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler:
+    """Timers and counters for the phases of a sim tick. When disabled, every call returns
+    immediately, so instrumentation can stay in the hot loop
+
+    Usage:
+        with profiler.phase("render"):
+            ...
+        profiler.count("collisions_tested", 4)
+        profiler.gauge("live_particles", 1200)
+
+    Instance Attributes
+        - enabled: Whether anything is recorded
+        - dump_path: JSON lines file that stats() is appended to every dump_interval seconds, if any
+        - dump_interval: Seconds of wall time between dumps
+    """
+    enabled: bool
+    dump_path: Optional[str]
+    dump_interval: float
+
+    def __init__(self, enabled=False, dump_path: Optional[str] = None, dump_interval=5.0):
+        self.enabled = enabled
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self._lock = threading.Lock()  # Network threads report into the same profiler
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything recorded so far"""
+        self._phases = {}  # name -> [calls, total seconds, max seconds]
+        self._counters = {}
+        self._gauges = {}
+        self._started = time.perf_counter()
+        self._last_dump = self._started
+
+    def phase(self, name: str):
+        """Return a context manager timing the enclosed block under name"""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """Record one run of phase name that took seconds"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._phases.get(name)
+            if entry is None:
+                self._phases[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def count(self, name: str, amount=1) -> None:
+        """Add amount to a running total, e.g. collisions tested"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value: float) -> None:
+        """Set a value which is sampled rather than summed, e.g. live particles"""
+        if not self.enabled:
+            return
+        self._gauges[name] = value
+
+    def stats(self) -> dict:
+        """Return everything recorded so far as plain JSON-able data"""
+        with self._lock:
+            return {
+                "elapsed": time.perf_counter() - self._started,
+                "phases": {name: {"calls": calls, "total": total, "mean": total / calls, "max": longest}
+                           for name, (calls, total, longest) in self._phases.items()},
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
+
+    def tick(self) -> None:
+        """Call once per sim tick, appends stats to dump_path when a dump is due"""
+        if not self.enabled or self.dump_path is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_dump >= self.dump_interval:
+            self._last_dump = now
+            self.dump()
+
+    def dump(self) -> None:
+        """Append current stats as one JSON line to dump_path"""
+        with open(self.dump_path, "a") as file:
+            file.write(json.dumps({"time": time.time(), **self.stats()}) + "\n")
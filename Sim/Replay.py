@@ -0,0 +1,158 @@
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from typing import Iterator
+import numpy as np
+from geometry.geometry import Point
+
+# Every record has the same size so a whole log can be read back in one call, and a
+# record cut short by a crash is simply dropped. Fields a record type does not use are 0
+RECORD = np.dtype([
+    ("kind", "<u1"),
+    ("leak_id", "<u4"),
+    ("time", "<f8"),
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("vx", "<f8"),
+    ("vy", "<f8"),
+], align=True)
+
+DRONE = 0  # x, y, vx, vy of the drone
+LEAK = 1  # leak_id started at x, y
+DETECTION = 2  # leak_id was detected for the first time
+REPAIR = 3  # leak_id was repaired
+REWIND = 4  # A snapshot was restored, the run continues from time and records after it are void
+
+
+class ReplayLog:
+    """Append-only recording of a run: drone trajectory, leak creations, detections and repairs.
+    Attach one to Sim.replay to start recording
+
+    Instance Attributes
+        - path: File the log is appended to
+        - drone_interval: Seconds of sim time between recorded drone samples
+    """
+    path: str
+    drone_interval: float
+
+    def __init__(self, path: str, drone_interval=0.05):
+        self.path = path
+        self.drone_interval = drone_interval
+        self._last_drone_time = -float("inf")
+
+        # Drop a partial record left at the end by a crash before appending after it
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size % RECORD.itemsize:
+                os.truncate(path, size - size % RECORD.itemsize)
+        self._file = open(path, "ab")
+
+    def _write(self, kind: int, time: float, leak_id=0, x=0.0, y=0.0, vx=0.0, vy=0.0) -> None:
+        self._file.write(np.array([(kind, leak_id, time, x, y, vx, vy)], dtype=RECORD).tobytes())
+
+    def record_drone(self, time: float, drone) -> None:
+        """Record the drone's state, at most once every drone_interval"""
+        if time - self._last_drone_time >= self.drone_interval:
+            self._last_drone_time = time
+            self._write(DRONE, time, 0, drone.pos.x, drone.pos.y, drone.velocity.x, drone.velocity.y)
+
+    def record_leak(self, time: float, leak) -> None:
+        self._write(LEAK, time, leak.id, leak.emitter_loc.x, leak.emitter_loc.y)
+
+    def record_detection(self, time: float, leak) -> None:
+        self._write(DETECTION, time, leak.id, leak.emitter_loc.x, leak.emitter_loc.y)
+
+    def record_repair(self, time: float, leak) -> None:
+        self._write(REPAIR, time, leak.id, leak.emitter_loc.x, leak.emitter_loc.y)
+
+    def record_rewind(self, time: float) -> None:
+        """Record that the sim went back to time, everything recorded after time is abandoned"""
+        self._write(REWIND, time)
+        self._last_drone_time = -float("inf")
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+@dataclass
+class ReplayFrame:
+    """State of a recorded run at one moment"""
+    time: float
+    drone_pos: Point
+    drone_velocity: Point
+    leaks: dict[int, Point]  # Leak id to emitter location, for leaks started so far
+    detected: set[int]  # Ids of leaks detected so far
+    repaired: set[int]  # Ids of leaks repaired so far
+
+
+class ReplayPlayer:
+    """Reads a ReplayLog back and reconstructs the run at any time without re-simulating"""
+
+    def __init__(self, path: str):
+        size = os.path.getsize(path)
+        records = np.fromfile(path, dtype=RECORD, count=size // RECORD.itemsize)
+        # Restoring a snapshot rewinds the sim. Records written before a rewind but after the
+        # time it went back to belong to the abandoned run, leak ids included, so they are dropped
+        keep = records["kind"] != REWIND
+        for index in np.flatnonzero(~keep).tolist():
+            keep[:index] &= records["time"][:index] <= records["time"][index]
+        records = records[keep]
+        records = records[np.argsort(records["time"], kind="stable")]
+
+        drone = records[records["kind"] == DRONE]
+        self.drone_times = drone["time"]
+        self.drone_states = np.stack((drone["x"], drone["y"], drone["vx"], drone["vy"]), axis=1)
+
+        leaks = records[records["kind"] == LEAK]
+        self.leak_times = leaks["time"]
+        self.leak_ids = leaks["leak_id"]
+        self.leak_locs = np.stack((leaks["x"], leaks["y"]), axis=1)
+
+        detections = records[records["kind"] == DETECTION]
+        self.detection_times = detections["time"]
+        self.detection_ids = detections["leak_id"]
+
+        repairs = records[records["kind"] == REPAIR]
+        self.repair_times = repairs["time"]
+        self.repair_ids = repairs["leak_id"]
+
+    def start_time(self) -> float:
+        return float(self.drone_times[0]) if len(self.drone_times) else 0.0
+
+    def end_time(self) -> float:
+        times = [t[-1] for t in (self.drone_times, self.leak_times, self.detection_times, self.repair_times) if len(t)]
+        return float(max(times)) if times else 0.0
+
+    def frame_at(self, time: float) -> ReplayFrame:
+        """Return the state of the run at time, linearly interpolating the drone between samples"""
+        if len(self.drone_times) == 0:
+            state = np.zeros(4)
+        else:
+            state = np.array([np.interp(time, self.drone_times, self.drone_states[:, i]) for i in range(4)])
+
+        n_leaks = np.searchsorted(self.leak_times, time, side="right")
+        n_detections = np.searchsorted(self.detection_times, time, side="right")
+        n_repairs = np.searchsorted(self.repair_times, time, side="right")
+        return ReplayFrame(
+            time=time,
+            drone_pos=Point(state[0], state[1]),
+            drone_velocity=Point(state[2], state[3]),
+            leaks={int(i): Point(x, y) for i, (x, y) in zip(self.leak_ids[:n_leaks], self.leak_locs[:n_leaks])},
+            detected=set(self.detection_ids[:n_detections].tolist()),
+            repaired=set(self.repair_ids[:n_repairs].tolist())
+        )
+
+    def frames(self, speed=1.0, fps=60.0) -> Iterator[ReplayFrame]:
+        """Yield frames fps times per second of playback, with playback running speed times faster
+        than the recorded sim time"""
+        for time in self.frame_times(speed, fps).tolist():
+            yield self.frame_at(time)
+
+    def frame_times(self, speed=1.0, fps=60.0) -> np.ndarray:
+        """Return the times of the frames yielded by frames"""
+        step = speed / fps
+        count = int((self.end_time() - self.start_time()) / step) + 1
+        return self.start_time() + np.arange(count) * step
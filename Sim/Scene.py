@@ -0,0 +1,102 @@
+from __future__ import annotations
+import json
+import struct
+import sys
+import numpy as np
+
+
+class Scene:
+    """Static layout of a sim stored as packed float arrays, so large plans never become
+    one Python object per segment
+
+    Binary layout (little endian): a header of MAGIC, VERSION and the wall, pipe and drone
+    start counts, followed by the walls, pipes and drone starts as contiguous float64 arrays.
+    Loading memory-maps the arrays straight out of the file
+
+    Instance Attributes
+        - walls: (n, 4) array of wall segments as x1, y1, x2, y2
+        - pipes: (m, 4) array of pipe segments as x1, y1, x2, y2
+        - drone_starts: (k, 2) array of drone start positions as x, y
+    """
+    walls: np.ndarray
+    pipes: np.ndarray
+    drone_starts: np.ndarray
+
+    MAGIC = b"PIPROSCN"
+    VERSION = 1
+    HEADER = struct.Struct("<8sI4xQQQ")
+
+    def __init__(self, walls: np.ndarray, pipes: np.ndarray, drone_starts: np.ndarray):
+        self.walls = np.asarray(walls, dtype=np.float64).reshape(-1, 4)
+        self.pipes = np.asarray(pipes, dtype=np.float64).reshape(-1, 4)
+        self.drone_starts = np.asarray(drone_starts, dtype=np.float64).reshape(-1, 2)
+
+    @staticmethod
+    def from_json(path: str) -> Scene:
+        """Read a scene from the JSON config schema used in configs/"""
+        with open(path, "r") as file:
+            loaded_json = json.load(file)
+
+        def segments(entries: list[dict]) -> list[tuple[float, ...]]:
+            return [(e["start"]["x"], e["start"]["y"], e["end"]["x"], e["end"]["y"]) for e in entries]
+
+        starts = loaded_json.get("drone_starts", [loaded_json["drone_start"]])
+        return Scene(np.array(segments(loaded_json["walls"])),
+                     np.array(segments(loaded_json["pipes"])),
+                     np.array([(s["x"], s["y"]) for s in starts]))
+
+    def to_json(self, path: str) -> None:
+        """Write the scene in the JSON config schema used in configs/"""
+        def segments(arr: np.ndarray) -> list[dict]:
+            return [{"start": {"x": x1, "y": y1}, "end": {"x": x2, "y": y2}} for x1, y1, x2, y2 in arr.tolist()]
+
+        starts = [{"x": x, "y": y} for x, y in self.drone_starts.tolist()]
+        data = {"walls": segments(self.walls), "pipes": segments(self.pipes), "drone_start": starts[0]}
+        if len(starts) > 1:
+            data["drone_starts"] = starts
+        with open(path, "w") as file:
+            json.dump(data, file)
+
+    def save(self, path: str) -> None:
+        """Write the scene in the packed binary format"""
+        with open(path, "wb") as file:
+            file.write(Scene.HEADER.pack(Scene.MAGIC, Scene.VERSION,
+                                         len(self.walls), len(self.pipes), len(self.drone_starts)))
+            for arr in (self.walls, self.pipes, self.drone_starts):
+                file.write(np.ascontiguousarray(arr, dtype="<f8").tobytes())
+
+    @staticmethod
+    def load(path: str, mmap=True) -> Scene:
+        """Read a scene in the packed binary format. With mmap the arrays are read-only views
+        onto the file, paged in by the OS as they are touched"""
+        with open(path, "rb") as file:
+            magic, version, n_walls, n_pipes, n_starts = Scene.HEADER.unpack(file.read(Scene.HEADER.size))
+        if magic != Scene.MAGIC:
+            raise ValueError(path + " is not a scene file")
+        if version != Scene.VERSION:
+            raise ValueError("Unsupported scene version " + str(version))
+
+        arrays = []
+        offset = Scene.HEADER.size
+        for count, width in ((n_walls, 4), (n_pipes, 4), (n_starts, 2)):
+            if count == 0:
+                arrays.append(np.zeros((0, width)))
+            elif mmap:
+                arrays.append(np.memmap(path, dtype="<f8", mode="r", offset=offset, shape=(count, width)))
+            else:
+                arrays.append(np.fromfile(path, dtype="<f8", count=count * width, offset=offset).reshape(count, width))
+            offset += count * width * 8
+        return Scene(*arrays)
+
+    @staticmethod
+    def open(path: str) -> Scene:
+        """Load a scene from either format, picked by file extension"""
+        return Scene.from_json(path) if path.endswith(".json") else Scene.load(path)
+
+
+if __name__ == "__main__":
+    # Convert a JSON config into the binary format: python Scene.py configs/in.json configs/out.scene
+    if len(sys.argv) != 3:
+        print("Usage: python Scene.py <input.json> <output.scene>")
+        sys.exit(1)
+    Scene.from_json(sys.argv[1]).save(sys.argv[2])
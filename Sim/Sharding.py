@@ -0,0 +1,379 @@
+from __future__ import annotations
+import multiprocessing
+import os
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Union
+import numpy as np
+from geometry.geometry import Point, Vector
+from geometry.helpers import vectors_to_array, closest_approach, scale_probability, probability_rate
+from Sim import Sim, Pipe, Leak
+from Events import LeakCreated, LeakRetired
+
+# Columns of a shard's particle pool, and of its handoff buffers which add the destination shard
+X, Y, VX, VY, AGE, LEAK_ID, DEST = range(7)
+POOL_COLUMNS = 6
+HANDOFF_COLUMNS = 7
+# Columns of the shared counts array, one row per shard
+POOL_COUNT, HANDOFF_COUNT = 0, 1  # Handoff counts take columns 1 and 2, one per buffer
+
+
+class Shard:
+    """The pipes, leak emitters and gas particles of one vertical strip of the world, run by a
+    worker process.
+
+    Particles live in a shared memory pool, one row per particle, so the coordinator can read
+    them without copying through a pipe. A particle that drifts out of the strip is moved to one of
+    two handoff buffers, alternating every tick, and the shard it drifted into picks it up at the
+    start of the next tick. Since every shard only writes its own buffer for this tick while reading
+    the others' from the last, shards never wait on each other within a tick
+
+    Instance Attributes
+        - index: Position of the strip, left to right
+        - edges: x coordinates of the inner strip boundaries, shared by all shards
+        - pool: (capacity, POOL_COLUMNS) view of the particle pool
+        - handoffs: Every shard's two (capacity, HANDOFF_COLUMNS) handoff buffers
+        - counts: (shards, 3) view of the shared pool and handoff counts
+    """
+    index: int
+    edges: np.ndarray
+    pool: np.ndarray
+    handoffs: list[list[np.ndarray]]
+    counts: np.ndarray
+
+    def __init__(self, index: int, edges: np.ndarray, pipes: np.ndarray, pipe_ids: np.ndarray,
+                 pool: np.ndarray, handoffs: list[list[np.ndarray]], counts: np.ndarray, seed: int):
+        self.index = index
+        self.edges = edges
+        self.pool = pool
+        self.handoffs = handoffs
+        self.counts = counts
+        self.rng = np.random.default_rng(seed)
+
+        self.pipes = pipes
+        self.pipe_ids = pipe_ids
+        self.pipe_active_leaks = np.zeros(len(pipes), dtype=np.int64)
+        self._pipe_row = {pipe_id: row for row, pipe_id in enumerate(pipe_ids.tolist())}
+
+        # Emitters, by leak id, of leaks that sprang in this strip:
+        # [x, y, pipe id, emitting, particles per second, speed multiplier]
+        self.emitters = {}
+        self._next_leak = 0
+        self._emit_cache = None
+
+    def _new_leak_id(self) -> int:
+        """Leak ids are interleaved between shards, so they are unique without asking the coordinator"""
+        leak_id = self._next_leak * len(self.handoffs) + self.index
+        self._next_leak += 1
+        return leak_id
+
+    def _absorb(self, parity: int) -> None:
+        """Take in particles other shards handed to this one during the last tick"""
+        n = int(self.counts[self.index, POOL_COUNT])
+        for shard, buffers in enumerate(self.handoffs):
+            count = int(self.counts[shard, HANDOFF_COUNT + parity])
+            if shard == self.index or count == 0:
+                continue
+            incoming = buffers[parity][:count]
+            incoming = incoming[incoming[:, DEST] == self.index, :POOL_COLUMNS]
+            take = min(len(incoming), len(self.pool) - n)
+            self.pool[n:n + take] = incoming[:take]
+            n += take
+        self.counts[self.index, POOL_COUNT] = n
+
+    def _roll_pipes(self, time_delta: float) -> list[tuple[int, float, float, int]]:
+        """Roll every pipe for a leak at once, return (leak id, x, y, pipe id) of new leaks"""
+        if len(self.pipes) == 0:
+            return []
+        prob = scale_probability(Pipe.LEAK_PROB_PER_HOUR, 60, time_delta, 10)
+        leaking = (self.rng.random(len(self.pipes)) < prob) & (self.pipe_active_leaks < Pipe.MAX_LEAKS)
+        new_leaks = []
+        for row in np.flatnonzero(leaking).tolist():
+            self.pipe_active_leaks[row] += 1
+            x1, y1, x2, y2 = self.pipes[row].tolist()
+            t = self.rng.random()
+            leak_id = self._new_leak_id()
+            pipe_id = int(self.pipe_ids[row])
+            # Emission is taken from a new Leak, as the coordinator creates for it
+            leak = Leak(Point(x1 + (x2 - x1) * t, y1 + (y2 - y1) * t))
+            self.emitters[leak_id] = [leak.emitter_loc.x, leak.emitter_loc.y, pipe_id, True,
+                                      probability_rate(leak.frequency, 1), leak.speed_multiplier]
+            new_leaks.append((leak_id, self.emitters[leak_id][0], self.emitters[leak_id][1], pipe_id))
+        if new_leaks:
+            self._emit_cache = None
+        return new_leaks
+
+    def _emit(self, time_delta: float) -> None:
+        """Spawn particles at every emitting leak, as many per leak as Leak._emit would"""
+        if self._emit_cache is None:
+            emitting = [(leak_id, x, y, rate, speed) for leak_id, (x, y, _, on, rate, speed)
+                        in self.emitters.items() if on]
+            self._emit_cache = np.array(emitting, dtype=float).reshape(-1, 5)
+        if len(self._emit_cache) == 0:
+            return
+        # Means past the cap all give MAX_BURST, clipping them keeps an infinite rate drawable
+        means = np.minimum(self._emit_cache[:, 3] * time_delta, 10 * Leak.MAX_BURST)
+        bursts = np.minimum(self.rng.poisson(means), Leak.MAX_BURST)
+        total = int(bursts.sum())
+        n = int(self.counts[self.index, POOL_COUNT])
+        total = min(total, len(self.pool) - n)
+        if total <= 0:
+            return
+
+        sources = np.repeat(self._emit_cache, bursts, axis=0)[:total]
+        new = self.pool[n:n + total]
+        new[:, X], new[:, Y], new[:, LEAK_ID] = sources[:, 1], sources[:, 2], sources[:, 0]
+        new[:, VX:VY + 1] = self.rng.uniform(-1.0, 1.0, (total, 2)) * sources[:, 4:5]
+        new[:, AGE] = 0.0
+        self.counts[self.index, POOL_COUNT] = n + total
+
+    def _detect(self, time_delta: float, drone: tuple[float, ...]) -> list[int]:
+        """Return ids of leaks with a particle the drone came within range of, as in Leak._detect"""
+        n = int(self.counts[self.index, POOL_COUNT])
+        if n == 0:
+            return []
+        start_x, start_y, delta_x, delta_y, radius = drone
+        particles = self.pool[:n]
+        within, entry = closest_approach(particles[:, X:Y + 1] - (start_x, start_y),
+                                         particles[:, VX:VY + 1] * time_delta - (delta_x, delta_y), radius)
+        if not within.any():
+            return []
+        life_left = (Leak.PARTICLE_DEATH - particles[:, AGE]) / time_delta if time_delta > 0 else 1.0
+        hits = within & (entry <= life_left)
+        return np.unique(particles[hits, LEAK_ID]).astype(int).tolist()
+
+    def _move(self, time_delta: float, parity: int) -> None:
+        """Move and age particles, drop dead ones and hand off ones that left the strip"""
+        n = int(self.counts[self.index, POOL_COUNT])
+        particles = self.pool[:n]
+        particles[:, X:Y + 1] += particles[:, VX:VY + 1] * time_delta
+        particles[:, AGE] += time_delta
+
+        alive = particles[:, AGE] <= Leak.PARTICLE_DEATH
+        dest = np.searchsorted(self.edges, particles[:, X], side="right")
+        leaving = alive & (dest != self.index)
+        out = self.handoffs[self.index][parity]
+        count = min(int(leaving.sum()), len(out))
+        out[:count, :POOL_COLUMNS] = particles[leaving][:count]
+        out[:count, DEST] = dest[leaving][:count]
+        self.counts[self.index, HANDOFF_COUNT + parity] = count
+
+        stay = alive & ~leaving
+        if not stay.all():
+            kept = particles[stay]
+            self.pool[:len(kept)] = kept
+            self.counts[self.index, POOL_COUNT] = len(kept)
+
+    def step(self, time_delta: float, drone: tuple[float, ...], parity: int,
+             repaired: list[int], retired: list[int]) -> tuple[list, list[int]]:
+        """Advance the strip by time_delta. drone is (start x, start y, delta x, delta y, radius) of
+        the drone's move this tick. Return (new leaks, ids of leaks the drone sensed)"""
+        self._absorb(1 - parity)
+        for leak_id in repaired:
+            self.emitters[leak_id][3] = False
+            self._emit_cache = None
+        for leak_id in retired:
+            pipe_id = self.emitters.pop(leak_id)[2]
+            self.pipe_active_leaks[self._pipe_row[pipe_id]] -= 1
+
+        new_leaks = self._roll_pipes(time_delta)
+        self._emit(time_delta)
+        detected = self._detect(time_delta, drone)
+        self._move(time_delta, parity)
+        return new_leaks, detected
+
+
+def _run_shard(index: int, edges: np.ndarray, pipes: np.ndarray, pipe_ids: np.ndarray,
+               capacity: int, pool_name: str, handoff_names: list[list[str]], counts_name: str,
+               shards: int, seed: int, conn) -> None:
+    """Worker process main loop, steps its shard whenever the coordinator asks"""
+    blocks = [SharedMemory(name=pool_name), SharedMemory(name=counts_name)]
+    pool = np.ndarray((capacity, POOL_COLUMNS), dtype=np.float64, buffer=blocks[0].buf)
+    counts = np.ndarray((shards, 3), dtype=np.int64, buffer=blocks[1].buf)
+    handoffs = []
+    for names in handoff_names:
+        buffers = []
+        for name in names:
+            blocks.append(SharedMemory(name=name))
+            buffers.append(np.ndarray((capacity, HANDOFF_COLUMNS), dtype=np.float64, buffer=blocks[-1].buf))
+        handoffs.append(buffers)
+    shard = Shard(index, edges, pipes, pipe_ids, pool, handoffs, counts, seed)
+
+    while True:
+        message = conn.recv()
+        if message[0] == "stop":
+            break
+        conn.send(shard.step(*message[1:]))
+
+    # Views must go before the blocks under them can close
+    del shard, pool, counts, handoffs, buffers
+    for block in blocks:
+        block.close()
+
+
+class ShardedSim(Sim):
+    """Sim that splits the world into vertical strips, each simulated by its own worker process,
+    so that one large scene can use several cores.
+
+    Strip boundaries are placed so each strip has about as many pipes. Each worker runs the pipes,
+    leak emitters and gas particles of its strip (see Shard), the particles held in shared memory.
+    The coordinator keeps the drone, walls and the leak lifecycle, sends every worker the drone's
+    move each tick and gathers which leaks it sensed, so notifications, repairs, replays,
+    telemetry and events work as in Sim, except for ParticlesExpired which workers don't raise.
+    The drone is never handed off between workers, every worker senses it wherever it is.
+
+    Only the particle gas mode is supported. Workers draw from their own random generators, so a
+    run is reproducible for a given seed and worker count but does not match a plain Sim. Call
+    close() when done to stop the workers and free the shared memory
+
+    Instance Attributes
+        - shards: Number of worker processes
+        - edges: x coordinates of the inner strip boundaries
+    """
+    shards: int
+    edges: np.ndarray
+
+    CAPACITY = 1000000  # Particles each strip can hold, more are not emitted
+
+    def __init__(self, walls: Union[list[Vector], np.ndarray], pipes: Union[list[Vector], np.ndarray],
+                 drone_start: Point, shards: Optional[int] = None, seed=0, capacity=CAPACITY):
+        super().__init__(walls, pipes, drone_start)
+        self.shards = shards or os.cpu_count() or 1
+        self.capacity = capacity
+        self._leaks_by_id = {}
+        self._retire_at = {}
+        self._ticks = 0
+        # Repaired and retired leak ids to pass on to each worker with its next step
+        self._pending = [([], []) for _ in range(self.shards)]
+
+        pipes_arr = vectors_to_array(pipes)
+        mid_x = (pipes_arr[:, 0] + pipes_arr[:, 2]) / 2
+        self.edges = np.quantile(mid_x, np.arange(1, self.shards) / self.shards) if len(pipes_arr) \
+            else np.zeros(self.shards - 1)
+        owner = np.searchsorted(self.edges, mid_x, side="right")
+
+        self._blocks = []
+        pool_names = [self._create(capacity * POOL_COLUMNS * 8) for _ in range(self.shards)]
+        handoff_names = [[self._create(capacity * HANDOFF_COLUMNS * 8) for _ in range(2)] for _ in range(self.shards)]
+        counts_name = self._create(self.shards * 3 * 8)
+        self._counts = np.ndarray((self.shards, 3), dtype=np.int64, buffer=self._blocks[-1].buf)
+        self._counts[:] = 0
+        self._pools = [np.ndarray((capacity, POOL_COLUMNS), dtype=np.float64, buffer=block.buf)
+                       for block in self._blocks[:self.shards]]
+
+        context = multiprocessing.get_context()
+        self._conns = []
+        self._workers = []
+        for i in range(self.shards):
+            ids = np.flatnonzero(owner == i)
+            parent, child = context.Pipe()
+            worker = context.Process(target=_run_shard, daemon=True, args=(
+                i, self.edges, pipes_arr[ids], ids, capacity, pool_names[i], handoff_names,
+                counts_name, self.shards, seed + i, child))
+            worker.start()
+            self._conns.append(parent)
+            self._workers.append(worker)
+
+    def _create(self, size: int) -> str:
+        block = SharedMemory(create=True, size=size)
+        self._blocks.append(block)
+        return block.name
+
+    def update(self, time_delta: float) -> None:
+        prof = self.profiler
+
+        with prof.phase("drone"):
+            self.drone.update(self, time_delta)
+        self.time += time_delta
+
+        start = self.drone.prev_pos
+        delta = self.drone.pos - start
+        drone = (start.x, start.y, delta.x, delta.y, self.drone.radius)
+        parity = self._ticks % 2
+        self._ticks += 1
+        with prof.phase("shards"):
+            for conn, (repaired, retired) in zip(self._conns, self._pending):
+                conn.send(("step", time_delta, drone, parity, repaired, retired))
+            results = [conn.recv() for conn in self._conns]
+        self._pending = [([], []) for _ in range(self.shards)]
+
+        for new_leaks, _ in results:
+            for leak_id, x, y, pipe_id in new_leaks:
+                leak = Leak(Point(x, y), self.pipes[pipe_id])
+                leak.id = leak_id
+                leak.pipe.active_leaks += 1
+                self.add_leak(leak)
+        for _, detected in results:
+            for leak_id in detected:
+                if leak_id in self._leaks_by_id:
+                    self.detect_gas(self._leaks_by_id[leak_id])
+
+        self._update_lifecycle()
+
+        if self.replay is not None:
+            self.replay.record_drone(self.time, self.drone)
+        if self.telemetry is not None:
+            self.telemetry.record(self.time, self.drone)
+        self.events.dispatch()
+
+        if prof.enabled:
+            prof.gauge("leaks", len(self.leaks))
+            prof.gauge("live_particles", int(self._counts[:, POOL_COUNT].sum()))
+            if self.outbox is not None:
+                prof.gauge("outbox_pending", self.outbox.pending())
+            prof.tick()
+
+    def add_leak(self, leak: Leak) -> None:
+        """Track a leak that sprang in one of the workers, it keeps the id the worker gave it"""
+        self.leaks.append(leak)
+        self._leaks_by_id[leak.id] = leak
+        if self.replay is not None:
+            self.replay.record_leak(self.time, leak)
+        if self.events.wants(LeakCreated):
+            self.events.emit(LeakCreated(self.time, leak))
+
+    def _update_lifecycle(self) -> None:
+        """Repair leaks as in Sim. A repaired leak's particles are in the workers, so it is retired
+        once its last particle must have died rather than once none are left"""
+        if Sim.REPAIR_DELAY is not None:
+            while self._repair_queue and self._repair_queue[0].detected_at + Sim.REPAIR_DELAY <= self.time:
+                self.repair_leak(self._repair_queue.popleft())
+
+        while self._repaired and self._retire_at[self._repaired[0].id] <= self.time:
+            self._retire_leak(self._repaired.pop(0))
+
+    def repair_leak(self, leak: Leak) -> None:
+        if leak.state in (Leak.REPAIRED, Leak.RETIRED):
+            return
+        super().repair_leak(leak)
+        self._retire_at[leak.id] = self.time + Leak.PARTICLE_DEATH
+        self._pending[leak.id % self.shards][0].append(leak.id)
+
+    def _retire_leak(self, leak: Leak) -> None:
+        leak.state = Leak.RETIRED
+        self.leaks.remove(leak)
+        del self._leaks_by_id[leak.id]
+        del self._retire_at[leak.id]
+        self.notified_leaks.discard(leak)
+        leak.pipe.active_leaks -= 1
+        self._pending[leak.id % self.shards][1].append(leak.id)
+        if self.events.wants(LeakRetired):
+            self.events.emit(LeakRetired(self.time, leak))
+
+    def particle_positions(self) -> np.ndarray:
+        """Return an (n, 2) array of every particle's position, read straight from the workers' pools"""
+        return np.concatenate([pool[:count, X:Y + 1] for pool, count
+                               in zip(self._pools, self._counts[:, POOL_COUNT].tolist())])
+
+    def close(self) -> None:
+        """Stop the workers and free the shared memory"""
+        for conn in self._conns:
+            conn.send(("stop",))
+        for worker in self._workers:
+            worker.join()
+        self._conns, self._workers = [], []
+        # Views must go before the blocks under them can close
+        self._pools = self._counts = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
@@ -1,49 +1,193 @@
 from __future__ import annotations
 import math
 import random
+import numpy as np
 from geometry.geometry import *
 from geometry.helpers import *
+from GasField import GasField
+from World import TiledWorld
+from Replay import ReplayLog
+from Profiler import Profiler
+from Outbox import Outbox
+from Telemetry import TelemetryReporter
+from Events import EventBus, LeakCreated, GasDetected, WallCollision, ParticlesExpired, LeakRepaired, LeakRetired
 import requests
 import threading
+from collections import deque
 from dataclasses import dataclass
+from typing import Optional, Union
 
 
 class Sim:
-    """Manages whole sim."""
+    """Manages whole sim.
+
+    Gas can be dispersed by one of two engines, chosen with gas_mode:
+        - GAS_PARTICLES: each leak emits individual particles which the drone must touch
+        - GAS_FIELD: leaks feed a concentration grid which the drone samples, with field_cell_size (m)
+          cells, by default as fine as GasField allows for the scene size
+
+    Walls are kept as an (n, 4) array of x1, y1, x2, y2 rows so that large scenes,
+    e.g. memory-mapped from a Scene file, never turn into per-segment objects. Walls, pipes
+    and leaks are also partitioned into a TiledWorld, so a tick only fully simulates the
+    area around the drone
+    """
     drone: Drone
-    walls: list[Wall]
+    walls: np.ndarray
     pipes: list[Pipe]
+    world: TiledWorld
+    time: float
+    replay: Optional[ReplayLog]
+    profiler: Profiler
+    outbox: Optional[Outbox]
+    telemetry: Optional[TelemetryReporter]
+    events: EventBus
+    gas_mode: str
+    gas_field: Optional[GasField]
 
     AIR_DENSITY = 1.2  # kg/m^3  TODO: NOT WORKING, FIX AIR DRAG
     AIR_MULT = 0.995  # Temporary air friction multiplier for speed of drone
+    REPAIR_DELAY = 60.0  # Seconds from detection until a crew repairs a leak, None to never repair
 
     POST_URL = "http://127.0.0.1:5000/ping-add"
+    BATCH_POST_URL = "http://127.0.0.1:5000/ping-add-batch"
+    TELEMETRY_URL = "http://127.0.0.1:5000/telemetry"
+
+    GAS_PARTICLES = "particles"
+    GAS_FIELD = "field"
 
-    def __init__(self, walls: list[Vector], pipes: list[Vector], drone_start: Point):
+    def __init__(self, walls: Union[list[Vector], np.ndarray], pipes: Union[list[Vector], np.ndarray],
+                 drone_start: Point, gas_mode=GAS_PARTICLES, field_cell_size=None):
         self.drone = Drone(drone_start)
-        self.walls = [Wall(v) for v in walls]
-        self.pipes = [Pipe(p) for p in pipes]
+        self.walls = vectors_to_array(walls)
+        self.pipes = [Pipe(Vector(Point(x1, y1), Point(x2, y2))) for x1, y1, x2, y2 in vectors_to_array(pipes).tolist()]
         self.leaks = []
-
-        self.responses = []
+        self.world = TiledWorld(self.walls, self.pipes)
+        self.time = 0.0
+        self._next_leak_id = 0
+
+        # Set to a ReplayLog to record the run
+        self.replay = None
+        # Disabled unless profiler.enabled is set
+        self.profiler = Profiler()
+        # Set to an Outbox to queue notifications durably, otherwise each is posted once from its own thread
+        self.outbox = None
+        # Set to a TelemetryReporter to stream the drone's track to the server
+        self.telemetry = None
+        # Subscribe here to hear about leaks, detections, collisions and so on
+        self.events = EventBus()
+
+        if gas_mode not in (Sim.GAS_PARTICLES, Sim.GAS_FIELD):
+            raise ValueError("Unknown gas mode " + str(gas_mode))
+        self.gas_mode = gas_mode
+        self.gas_field = GasField.from_scene(self.walls, vectors_to_array(pipes), drone_start, field_cell_size) \
+            if gas_mode == Sim.GAS_FIELD else None
+
+        self.responses_received = 0
         # Tracks leaks already notified, to prevent spam notification
-        self.notified_leaks = []
+        self.notified_leaks = set()
+        # Detected leaks in detection order, waiting for repair
+        self._repair_queue = deque()
+        # Repaired leaks whose particles are still around
+        self._repaired = []
 
     def update(self, time_delta: float) -> None:
-        # Compute drone physics / logic
-        self.drone.update(self, time_delta)
-
-        # Run pipes and gets back leaks, if any
-        for pipe in self.pipes:
-            self.leaks.extend(pipe.update(self, time_delta))
+        prof = self.profiler
 
-        # Run leak particle emitter
-        for leak in self.leaks:
-            leak.update(self, time_delta)
-
-        #print("Res count:", len(self.responses))
-        #print("Detect count:", self.count)
-        #print("Reqs started:", self.requests_started)
+        # Compute drone physics / logic
+        with prof.phase("drone"):
+            self.drone.update(self, time_delta)
+
+        # Run pipes and leak particle emitters of the tiles that are due, gets back new leaks, if any
+        self.time += time_delta
+        for leak in self.world.update(self, self.time):
+            self.add_leak(leak)
+
+        if self.gas_field is not None:
+            # Disperse gas over the grid and let the drone sniff it
+            with prof.phase("gas_field"):
+                self.gas_field.update(time_delta)
+            with prof.phase("detection"):
+                if self.leaks and self.gas_field.is_detected(self.drone.pos):
+                    leak = self._nearest_leak(self.drone.pos)
+                    if leak is not None:
+                        self.detect_gas(leak)
+
+        self._update_lifecycle()
+
+        if self.replay is not None:
+            self.replay.record_drone(self.time, self.drone)
+        if self.telemetry is not None:
+            self.telemetry.record(self.time, self.drone)
+        self.events.dispatch()
+
+        if prof.enabled:
+            prof.gauge("leaks", len(self.leaks))
+            prof.gauge("live_particles", sum(len(leak.particle_age) for leak in self.leaks))
+            if self.outbox is not None:
+                prof.gauge("outbox_pending", self.outbox.pending())
+            prof.tick()
+
+    def add_leak(self, leak: Leak) -> None:
+        """Start simulating a new leak"""
+        leak.id = self._next_leak_id
+        self._next_leak_id += 1
+        self.leaks.append(leak)
+        self.world.add_leak(leak, self.time)
+        if self.gas_field is not None:
+            self.gas_field.add_source(leak)
+        if self.replay is not None:
+            self.replay.record_leak(self.time, leak)
+        if self.events.wants(LeakCreated):
+            self.events.emit(LeakCreated(self.time, leak))
+
+    def _update_lifecycle(self) -> None:
+        """Repair leaks once REPAIR_DELAY has passed since their detection, and retire repaired
+        leaks once their last particle is gone, or with a gas field, once the gas at their emitter has
+        fallen below the detection threshold"""
+        if Sim.REPAIR_DELAY is not None:
+            while self._repair_queue and self._repair_queue[0].detected_at + Sim.REPAIR_DELAY <= self.time:
+                self.repair_leak(self._repair_queue.popleft())
+
+        if self._repaired:
+            still_around = []
+            for leak in self._repaired:
+                if self._gas_lingers(leak):
+                    still_around.append(leak)
+                else:
+                    self._retire_leak(leak)
+            self._repaired = still_around
+
+    def _gas_lingers(self, leak: Leak) -> bool:
+        """Return if gas of a repaired leak is still around"""
+        if self.gas_field is not None:
+            # Judged by its own cell only, gas of other leaks nearby must not keep it around. Until
+            # then, gas detected near it is still its own and must not be blamed on another leak
+            return self.gas_field.sample(leak.emitter_loc) >= GasField.DETECTION_THRESHOLD
+        return len(leak.particle_age) > 0
+
+    def repair_leak(self, leak: Leak) -> None:
+        """Stop a leak from emitting, it is retired once its gas has dispersed"""
+        if leak.state in (Leak.REPAIRED, Leak.RETIRED):
+            return
+        leak.state = Leak.REPAIRED
+        if self.gas_field is not None:
+            self.gas_field.remove_source(leak)
+        if self.replay is not None:
+            self.replay.record_repair(self.time, leak)
+        if self.events.wants(LeakRepaired):
+            self.events.emit(LeakRepaired(self.time, leak))
+        self._repaired.append(leak)
+
+    def _retire_leak(self, leak: Leak) -> None:
+        """Forget a repaired leak entirely so that memory stays flat over long runs"""
+        leak.state = Leak.RETIRED
+        self.leaks.remove(leak)
+        self.world.remove_leak(leak)
+        self.notified_leaks.discard(leak)
+        if leak.pipe is not None:
+            leak.pipe.active_leaks -= 1
+        if self.events.wants(LeakRetired):
+            self.events.emit(LeakRetired(self.time, leak))
 
     @staticmethod
     def air_drag(speed: float, drag_coeff: float, cross_section_area: float):
@@ -53,27 +197,53 @@ class Sim:
         """Apply an x,y component force in Newtons on the drone"""
         self.drone.forces.append(Point(x, y))
 
+    def _nearest_leak(self, pos: Point) -> Optional[Leak]:
+        """The field does not know which leak its gas came from, so attribute it to the closest one,
+        repaired ones included. None if no leak is close enough for its gas to reach pos"""
+        leak = min(self.leaks, key=lambda leak: dist(leak.emitter_loc, pos))
+        return leak if dist(leak.emitter_loc, pos) <= GasField.ATTRIBUTION_RADIUS else None
+
     def detect_gas(self, leak_source: Leak):
         """This function is called as a callback from leak emitters
         when gas is detected and sends a notification request to server"""
-        if leak_source not in self.notified_leaks:
-            self.notified_leaks.append(leak_source)
+        if leak_source not in self.notified_leaks and leak_source.state == Leak.ACTIVE:
+            self.notified_leaks.add(leak_source)
+            leak_source.state = Leak.DETECTED
+            leak_source.detected_at = self.time
+            self._repair_queue.append(leak_source)
+            if self.replay is not None:
+                self.replay.record_detection(self.time, leak_source)
+            if self.events.wants(GasDetected):
+                self.events.emit(GasDetected(self.time, leak_source, self.drone.pos))
+            self.profiler.count("notifications")
             param = [leak_source.emitter_loc.x, leak_source.emitter_loc.y]
-            threading.Thread(target=self.notify_server, args=(param,)).start()
+            self.notify_server(param)
 
     def notify_server(self, leak_pos: list[float]) -> None:
-        """Notify server of leak!"""
+        """Notify server of leak! Goes through the outbox if there is one, never blocks the sim"""
+        if self.outbox is not None:
+            self.outbox.append(leak_pos)
+        else:
+            threading.Thread(target=self._post_notification, args=(leak_pos,)).start()
+
+    def _post_notification(self, leak_pos: list[float]) -> None:
+        """Post a single notification, lost if the server can't be reached"""
         print("test thread ran!")
         print("I am the arg:", leak_pos)
-        res = requests.post(Sim.POST_URL, json={"location": leak_pos})
+        self.profiler.count("notifications_in_flight", 1)
+        try:
+            with self.profiler.phase("notify"):
+                res = requests.post(Sim.POST_URL, json={"location": leak_pos})
+        finally:
+            self.profiler.count("notifications_in_flight", -1)
         print(res)
-        self.responses.append(res)
-
+        self.responses_received += 1
 
 
 @dataclass
 class Wall:
-    """Represents a wall which you cannot pass through"""
+    """Represents a wall which you cannot pass through. Sim stores walls as array rows,
+    this is only built for a wall that is being collided with"""
     vec: Vector
 
 
@@ -82,6 +252,7 @@ class Drone:
 
     Instance Attributes
         - pos: Center position of drone
+        - prev_pos: Center position of drone at the start of the latest update
         - radius: Size of drone
         - velocity: point relative to drone center indicating velocity x,y (m/s)
         - accel: point relative to drone center indicating acceleration x,y (m/s^2)
@@ -91,6 +262,7 @@ class Drone:
     """
     radius: float
     pos: Point
+    prev_pos: Point
     velocity: Point
     accel: Point
     forces: list[Point]
@@ -98,6 +270,9 @@ class Drone:
     mass: float
 
     DRAG_COEFFICIENT = 0.35
+    RESTITUTION = 0.0  # 0 slides along walls, 1 bounces off them without losing speed
+    COLLISION_SKIN = 1e-6  # Gap (m) kept between drone and wall after an impact
+    MAX_COLLISION_ITERATIONS = 4  # Impacts resolved per step, e.g. sliding into a corner
 
     def __init__(self, pos: Point, radius=0.1):
         self.radius = radius
@@ -105,6 +280,7 @@ class Drone:
         self.mass = 0.3
 
         self.pos = pos
+        self.prev_pos = pos
         self.velocity = Point(0.0, 0.0)
         self.accel = Point(0.0, 0.0)
 
@@ -163,31 +339,63 @@ class Drone:
             constant_acceleration_position(self.velocity.y, self.accel.y, time_delta)
         )
 
-        #print("Pos delta:", delta_pos)
-        # Checks collisions
-        collision_wall = None
-        for w in sim.walls:
-            if are_vectors_intersecting(w.vec, Vector(self.pos, self.pos + delta_pos)):
-                collision_wall = w
-
         # Change velocity based on acceleration
         self.velocity += self.accel * time_delta
 
         # Apply Air Drag
         self.velocity *= Sim.AIR_MULT
 
-        if collision_wall is None:
-            # Shift Position
-            self.pos += delta_pos
-        else:
-            # Resolve collision
-            self._resolve_wall_collision(collision_wall)
+        # Shift position, stopping at and sliding along any walls in the way
+        self._move(sim, delta_pos)
 
         #print("New Vel:", self.velocity)
 
-    def _resolve_wall_collision(self, wall: Wall):
-        """Apply changes to kinematic quantities post-collision"""
-        self.velocity *= 0
+    def _move(self, sim: Sim, delta_pos: Point) -> None:
+        """Sweep the drone's circle along delta_pos. On impact, advance to the time of impact and
+        spend the rest of the step sliding along (or bouncing off) the wall"""
+        remaining = delta_pos
+        for _ in range(Drone.MAX_COLLISION_ITERATIONS):
+            if remaining.x == 0 and remaining.y == 0:
+                return
+            impact = self._first_wall_impact(sim, remaining)
+            if impact is None:
+                self.pos += remaining
+                return
+
+            t, normal, wall = impact
+            # Stop at the point of contact, nudged off the wall so the next sweep starts clear of it
+            self.pos += remaining * t + normal * Drone.COLLISION_SKIN
+            remaining = remaining * (1 - t)
+            remaining -= normal * ((1 + Drone.RESTITUTION) * min(dot(remaining, normal), 0.0))
+            if sim.events.wants(WallCollision):
+                sim.events.emit(WallCollision(sim.time, wall.vec, normal, self.velocity))
+            self._resolve_wall_collision(wall, normal)
+
+    def _first_wall_impact(self, sim: Sim, delta_pos: Point) -> Optional[tuple[float, Point, Wall]]:
+        """Return (time of impact, wall normal, wall) for the first wall hit moving along delta_pos"""
+        if len(sim.walls) == 0:
+            return None
+        # Cheap rejection of walls the swept circle cannot reach this step, first by tile then by distance
+        reach = self.radius + dist((0, 0), delta_pos)
+        nearby = sim.walls[sim.world.walls_near(self.pos, reach)]
+        candidates = nearby[distance_to_segments_array(self.pos, nearby) < reach]
+
+        sim.profiler.count("collisions_tested", len(candidates))
+
+        first = None
+        for x1, y1, x2, y2 in candidates.tolist():
+            vec = Vector(Point(x1, y1), Point(x2, y2))
+            impact = swept_circle_impact(self.pos, delta_pos, self.radius, vec)
+            if impact is not None and (first is None or impact[0] < first[0]):
+                first = (impact[0], impact[1], Wall(vec))
+        return first
+
+    def _resolve_wall_collision(self, wall: Wall, normal: Point):
+        """Apply changes to kinematic quantities post-collision. Velocity into the wall is removed
+        (sliding) or reflected, depending on RESTITUTION"""
+        into_wall = dot(self.velocity, normal)
+        if into_wall < 0:
+            self.velocity -= normal * ((1 + Drone.RESTITUTION) * into_wall)
 
     def update(self, sim: Sim, time_delta: float) -> None:
         """Update drone forces and other physical properties. Resolve collisions"""
@@ -196,78 +404,145 @@ class Drone:
         self._compute_net_force(sim)
         self.forces = []
 
+        self.prev_pos = self.pos
+
         self._perform_motion(sim, time_delta)
 
 
 class Pipe:
-    """Pipes that can leak"""
+    """Pipes that can leak
+
+    Instance Attributes
+        - vec: Vector the pipe runs along
+        - active_leaks: Number of this pipe's leaks that are not retired yet
+    """
     vec: Vector
+    active_leaks: int
 
     LEAK_PROB_PER_HOUR = 0.999
+    MAX_LEAKS = 3  # A pipe with this many unretired leaks does not spring any more
 
     def __init__(self, vec: Vector):
         self.vec = vec
+        self.active_leaks = 0
 
     def update(self, sim: Sim, time_delta: float) -> list[Leak]:
         """Return leaks that occurred, if any"""
+        if self.active_leaks >= Pipe.MAX_LEAKS:
+            return []
         prob = scale_probability(Pipe.LEAK_PROB_PER_HOUR, 60, time_delta, 10)
         #print("Leak Probability", prob)
         roll_result = roll_probability(prob)
         #print("Roll Result", roll_result)
         if roll_result:
-            return [Leak(point_along_vector(self.vec, random.random()))]
+            self.active_leaks += 1
+            return [Leak(point_along_vector(self.vec, random.random()), self)]
         return []
 
 
 class Leak:
     """Leak emits gas particles from a location and keeps track of particles
-    pertaining to that leak
+    pertaining to that leak. Particles are stored as parallel arrays, one row per particle
+
+    A leak goes through the states ACTIVE (emitting, not noticed yet), DETECTED (a drone found it,
+    still emitting), REPAIRED (no longer emitting, gas still around) and RETIRED (removed from the sim)
 
     Instance Attributes:
+        - id: Unique number within the sim, assigned by Sim.add_leak
+        - state: One of ACTIVE, DETECTED, REPAIRED, RETIRED
+        - pipe: Pipe the leak sprang from, if any
+        - detected_at: Sim time of detection, if detected
         - emitter_loc: Point from where emission occurs
-        - frequency: Probability that a particle will spawn over a second
-        - particles: A list containing [[x, y], (vx, vy), lifetime] of a particle
+        - frequency: Probability that a particle will spawn over a second, particles spawn at the
+          matching steady rate
+        - particle_pos: (n, 2) array of particle x,y positions
+        - particle_vel: (n, 2) array of particle x,y velocities (m/s)
+        - particle_age: (n,) array of seconds each particle has been alive
     """
+    id: Optional[int]
+    state: str
+    pipe: Optional[Pipe]
+    detected_at: Optional[float]
     emitter_loc: Point
     frequency: float
-    particles: list[list[list[float, float], tuple[float, float], float]]
+    particle_pos: np.ndarray
+    particle_vel: np.ndarray
+    particle_age: np.ndarray
+
+    ACTIVE = "active"
+    DETECTED = "detected"
+    REPAIRED = "repaired"
+    RETIRED = "retired"
 
     PARTICLE_DEATH = 20.0
+    MAX_BURST = 100  # Most particles spawned in one update
 
-    def __init__(self, emitter_loc: Point):
+    def __init__(self, emitter_loc: Point, pipe: Optional[Pipe] = None):
+        self.id = None
+        self.state = Leak.ACTIVE
+        self.pipe = pipe
+        self.detected_at = None
         self.emitter_loc = emitter_loc
 
         self.frequency = 0.99
-        self.particles = []
-        self.speed_multiplier = 0.003
-
-    def update(self, sim: Sim, time_delta: float):
-        """Update gas particle motion"""
-        prob = scale_probability(self.frequency, 1, time_delta, 10)
-        roll = roll_probability(prob)
-        while roll:
-            roll = roll_probability(prob)
-
-            self.particles.append([[self.emitter_loc.x, self.emitter_loc.y], (
+        self.particle_pos = np.zeros((0, 2))
+        self.particle_vel = np.zeros((0, 2))
+        self.particle_age = np.zeros(0)
+        self.speed_multiplier = 0.18
+
+    def _emit(self, time_delta: float) -> None:
+        """Spawn new particles at the emitter. The count is drawn from the emission rate, so one long
+        step, e.g. a coarse catch-up of a far tile, spawns as many as the short steps it covers"""
+        count = roll_count(probability_rate(self.frequency, 1) * time_delta, Leak.MAX_BURST)
+        velocities = []
+        for _ in range(count):
+            velocities.append((
                 random.random() * self.speed_multiplier * random.choice([-1, 1]),
                 random.random() * self.speed_multiplier * random.choice([-1, 1])
-            ), 0.0])
-        #print("Particle Prob:", prob)
-        #print("Particle Roll:", roll)
-
-        trash = []
-        # Move particles
-        for p in self.particles:
-            # Send callback
-            if dist(sim.drone.pos, p[0]) < sim.drone.radius:
+            ))
+        if count:
+            self.particle_pos = np.concatenate(
+                (self.particle_pos, np.tile((self.emitter_loc.x, self.emitter_loc.y), (count, 1))))
+            self.particle_vel = np.concatenate((self.particle_vel, np.array(velocities)))
+            self.particle_age = np.concatenate((self.particle_age, np.zeros(count)))
+
+    def update(self, sim: Sim, time_delta: float, detect=True):
+        """Update gas particle motion. Checks whether the drone sniffed any particle only if detect"""
+        prof = sim.profiler
+        if self.state in (Leak.ACTIVE, Leak.DETECTED):
+            with prof.phase("emission"):
+                self._emit(time_delta)
+        if len(self.particle_age) == 0:
+            return
+
+        step = self.particle_vel * time_delta
+        if detect:
+            with prof.phase("detection"):
+                self._detect(sim, step, time_delta)
+
+        # Move particles and remove the ones that outlived their lifetime
+        with prof.phase("particles"):
+            self.particle_pos += step
+            self.particle_age += time_delta
+            alive = self.particle_age <= Leak.PARTICLE_DEATH
+            if not alive.all():
+                expired = len(alive) - int(alive.sum())
+                prof.count("particles_expired", expired)
+                if sim.events.wants(ParticlesExpired):
+                    sim.events.emit(ParticlesExpired(sim.time, self, expired))
+                self.particle_pos = self.particle_pos[alive]
+                self.particle_vel = self.particle_vel[alive]
+                self.particle_age = self.particle_age[alive]
+
+    def _detect(self, sim: Sim, step: np.ndarray, time_delta: float) -> None:
+        """Notify sim if the drone came within range of any particle while they moved by step"""
+        # Test the whole step, not just its endpoints, so fast drones or long steps can't skip past gas
+        drone_start = sim.drone.prev_pos
+        drone_delta = sim.drone.pos - drone_start
+        within, entry = closest_approach(self.particle_pos - (drone_start.x, drone_start.y),
+                                         step - (drone_delta.x, drone_delta.y), sim.drone.radius)
+        if within.any():
+            # Ignore particles that would only come into range after dying
+            life_left = (Leak.PARTICLE_DEATH - self.particle_age) / time_delta if time_delta > 0 else 1.0
+            if (entry <= life_left).any():
                 sim.detect_gas(self)
-
-            p[0][0] += p[1][0]
-            p[0][1] += p[1][1]
-            p[2] += time_delta
-            # Particle lifetime
-            if p[2] > Leak.PARTICLE_DEATH:
-                trash.append(p)
-        for p in trash:
-            self.particles.remove(p)
-
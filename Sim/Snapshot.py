@@ -0,0 +1,130 @@
+from __future__ import annotations
+import heapq
+import pickle
+import random
+import zlib
+from collections import deque
+import numpy as np
+from geometry.geometry import Point
+from Sim import Sim, Leak
+
+VERSION = 2
+
+
+def take_snapshot(sim: Sim) -> bytes:
+    """Return the full dynamic state of the sim, including the RNG, as a compressed blob.
+
+    Static geometry (walls and pipes) is left out so snapshots stay small no matter how big the
+    scene is. Restore with restore_snapshot onto a Sim built from the same scene"""
+    drone = sim.drone
+    leaks = sim.leaks
+    pipe_index = {id(pipe): i for i, pipe in enumerate(sim.pipes)}
+    state = {
+        "version": VERSION,
+        "n_walls": len(sim.walls),
+        "n_pipes": len(sim.pipes),
+        "gas_mode": sim.gas_mode,
+        "time": sim.time,
+        "next_leak_id": sim._next_leak_id,
+        "rng": random.getstate(),
+        "drone": np.array([drone.radius, drone.mass, *drone.pos, *drone.prev_pos, *drone.velocity,
+                           *drone.accel, *drone.net_force]),
+        "drone_forces": np.array([tuple(f) for f in drone.forces]).reshape(-1, 2),
+        # Leaks as one row each, their particles concatenated with per-leak counts
+        "leak_ids": np.array([leak.id for leak in leaks], dtype=np.int64),
+        "leak_states": [leak.state for leak in leaks],
+        "leak_detected_at": [leak.detected_at for leak in leaks],
+        "leak_pipes": [-1 if leak.pipe is None else pipe_index[id(leak.pipe)] for leak in leaks],
+        "pipe_active_leaks": np.array([pipe.active_leaks for pipe in sim.pipes], dtype=np.int64),
+        "repair_queue": [leak.id for leak in sim._repair_queue],
+        "repaired": [leak.id for leak in sim._repaired],
+        "leak_params": np.array([(leak.emitter_loc.x, leak.emitter_loc.y, leak.frequency, leak.speed_multiplier)
+                                 for leak in leaks]).reshape(-1, 4),
+        "particle_counts": np.array([len(leak.particle_age) for leak in leaks], dtype=np.int64),
+        "particle_pos": np.concatenate([leak.particle_pos for leak in leaks]) if leaks else np.zeros((0, 2)),
+        "particle_vel": np.concatenate([leak.particle_vel for leak in leaks]) if leaks else np.zeros((0, 2)),
+        "particle_age": np.concatenate([leak.particle_age for leak in leaks]) if leaks else np.zeros(0),
+        "notified": [leak.id for leak in sim.notified_leaks],
+        "tiles": {key: tile.last_update for key, tile in sim.world.tiles.items()},
+        "schedule": list(sim.world._schedule),
+        "concentration": None if sim.gas_field is None else sim.gas_field.concentration,
+    }
+    return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def restore_snapshot(sim: Sim, data: bytes) -> None:
+    """Replace the dynamic state of sim with a snapshot from take_snapshot"""
+    state = pickle.loads(zlib.decompress(data))
+    if state["version"] != VERSION:
+        raise ValueError("Unsupported snapshot version " + str(state["version"]))
+    if state["n_walls"] != len(sim.walls) or state["n_pipes"] != len(sim.pipes) or \
+            state["gas_mode"] != sim.gas_mode:
+        raise ValueError("Snapshot was taken from a different scene")
+
+    sim.time = state["time"]
+    sim._next_leak_id = state["next_leak_id"]
+    random.setstate(state["rng"])
+
+    drone = sim.drone
+    d = state["drone"].tolist()
+    drone.radius, drone.mass = d[0], d[1]
+    drone.pos, drone.prev_pos, drone.velocity = Point(d[2], d[3]), Point(d[4], d[5]), Point(d[6], d[7])
+    drone.accel, drone.net_force = Point(d[8], d[9]), Point(d[10], d[11])
+    drone.forces = [Point(x, y) for x, y in state["drone_forces"].tolist()]
+
+    # Rebuild leaks, re-registering them with the world and field without replaying any events
+    for tile in sim.world.tiles.values():
+        tile.leaks = []
+    if sim.gas_field is not None:
+        sim.gas_field.clear_sources()
+    sim.leaks = []
+    ends = np.cumsum(state["particle_counts"])
+    for i, (leak_id, params) in enumerate(zip(state["leak_ids"].tolist(), state["leak_params"].tolist())):
+        pipe = state["leak_pipes"][i]
+        leak = Leak(Point(params[0], params[1]), None if pipe < 0 else sim.pipes[pipe])
+        leak.id = leak_id
+        leak.state = state["leak_states"][i]
+        leak.detected_at = state["leak_detected_at"][i]
+        leak.frequency, leak.speed_multiplier = params[2], params[3]
+        start, end = (ends[i - 1] if i else 0), ends[i]
+        leak.particle_pos = state["particle_pos"][start:end].copy()
+        leak.particle_vel = state["particle_vel"][start:end].copy()
+        leak.particle_age = state["particle_age"][start:end].copy()
+        sim.leaks.append(leak)
+        sim.world.add_leak(leak, sim.time)
+        if sim.gas_field is not None and leak.state in (Leak.ACTIVE, Leak.DETECTED):
+            sim.gas_field.add_source(leak)
+    for pipe, active_leaks in zip(sim.pipes, state["pipe_active_leaks"].tolist()):
+        pipe.active_leaks = active_leaks
+
+    by_id = {leak.id: leak for leak in sim.leaks}
+    sim.notified_leaks = {by_id[i] for i in state["notified"] if i in by_id}
+    sim._repair_queue = deque(by_id[i] for i in state["repair_queue"])
+    sim._repaired = [by_id[i] for i in state["repaired"]]
+
+    world = sim.world
+    for key, last_update in state["tiles"].items():
+        world._get_tile(key).last_update = last_update
+    for tile in world.tiles.values():
+        tile.scheduled = False
+    world._schedule = list(state["schedule"])
+    heapq.heapify(world._schedule)
+    for _, key in world._schedule:
+        world.tiles[key].scheduled = True
+
+    if sim.gas_field is not None:
+        sim.gas_field.concentration = state["concentration"].copy()
+    if sim.replay is not None:
+        sim.replay.record_rewind(sim.time)
+
+
+def save_snapshot(sim: Sim, path: str) -> None:
+    """Write a snapshot of sim to path"""
+    with open(path, "wb") as file:
+        file.write(take_snapshot(sim))
+
+
+def load_snapshot(sim: Sim, path: str) -> None:
+    """Restore sim from a snapshot file written by save_snapshot"""
+    with open(path, "rb") as file:
+        restore_snapshot(sim, file.read())
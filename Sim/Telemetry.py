@@ -0,0 +1,83 @@
+from __future__ import annotations
+import threading
+from collections import deque
+import requests
+
+
+class TelemetryReporter:
+    """Samples a drone's position and velocity and posts them to the server in batches from a
+    background thread, so the dashboard can show where drones are and have been.
+
+    Unlike leak notifications, telemetry is allowed to be lost: samples wait in a bounded buffer
+    and the oldest are dropped if the server stays unreachable for long
+
+    Instance Attributes
+        - url: Server endpoint accepting telemetry batches
+        - drone_id: Name the server files the samples under
+        - interval: Sim seconds between samples
+    """
+    url: str
+    drone_id: str
+    interval: float
+
+    BUFFER_SIZE = 5000  # Samples kept while the server is unreachable
+    SEND_PERIOD = 1.0  # Real seconds between batches
+    TIMEOUT = 5.0
+
+    def __init__(self, url: str, drone_id="0", interval=0.2, start=True):
+        self.url = url
+        self.drone_id = drone_id
+        self.interval = interval
+        self._buffer = deque(maxlen=TelemetryReporter.BUFFER_SIZE)
+        self._next_sample = 0.0
+        self._stopping = threading.Event()
+        self._thread = None
+        if start:
+            self.start()
+
+    def record(self, time: float, drone) -> None:
+        """Buffer a sample of drone if one is due at sim time"""
+        if time < self._next_sample - self.interval:
+            # Sim time went back past the last sample, e.g. a snapshot was restored
+            self._next_sample = time
+        if time < self._next_sample:
+            return
+        self._next_sample = time + self.interval
+        self._buffer.append([time, drone.pos.x, drone.pos.y, drone.velocity.x, drone.velocity.y])
+
+    def send_batch(self) -> bool:
+        """Post everything buffered so far, return False if the server could not be reached.
+        Samples of a failed batch go back in the buffer, unless newer ones have pushed them out"""
+        batch = []
+        while self._buffer:
+            batch.append(self._buffer.popleft())
+        if not batch:
+            return True
+        try:
+            res = requests.post(self.url, json={"drones": {self.drone_id: batch}}, timeout=TelemetryReporter.TIMEOUT)
+            res.raise_for_status()
+        except requests.RequestException:
+            room = self._buffer.maxlen - len(self._buffer)
+            if room > 0:
+                self._buffer.extendleft(reversed(batch[-room:]))
+            return False
+        return True
+
+    def _run(self) -> None:
+        while not self._stopping.wait(TelemetryReporter.SEND_PERIOD):
+            self.send_batch()
+
+    def start(self) -> None:
+        """Start the background sender"""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background sender, making one last attempt to send what is buffered"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.send_batch()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+import heapq
+import math
+import numpy as np
+from geometry.geometry import Point
+from geometry.helpers import point_along_vector
+
+
+class Tile:
+    """One square chunk of the world
+
+    Instance Attributes
+        - key: (col, row) of the tile in the tile grid
+        - wall_ids: Indices into Sim.walls of walls overlapping the tile
+        - pipes: Pipes whose midpoint lies in the tile
+        - leaks: Leaks whose emitter lies in the tile
+        - last_update: Sim time up to which the tile's pipes and leaks have been advanced
+        - scheduled: Whether the tile has a pending coarse update queued
+    """
+    key: tuple[int, int]
+    wall_ids: np.ndarray
+    pipes: list
+    leaks: list
+    last_update: float
+    scheduled: bool
+
+    def __init__(self, key: tuple[int, int]):
+        self.key = key
+        self.wall_ids = np.zeros(0, dtype=np.intp)
+        self.pipes = []
+        self.leaks = []
+        self.last_update = 0.0
+        self.scheduled = False
+
+    def advance(self, sim, now: float, full: bool) -> list:
+        """Advance the tile's pipes and leaks from last_update to now and return any new leaks.
+        Gas detection is only run when full, coarse updates cannot be near the drone"""
+        time_delta = now - self.last_update
+        self.last_update = now
+        if time_delta <= 0:
+            return []
+
+        new_leaks = []
+        with sim.profiler.phase("pipes"):
+            for pipe in self.pipes:
+                new_leaks.extend(pipe.update(sim, time_delta))
+        if sim.gas_field is None:
+            for leak in self.leaks:
+                leak.update(sim, time_delta, detect=full)
+        return new_leaks
+
+
+class TiledWorld:
+    """Spatial partition of the scene into square tiles, so that a tick only does full work
+    near the drone.
+
+    Tiles within ACTIVE_RADIUS of the drone are advanced every tick. Every other tile that has
+    pipes or leaks is advanced coarsely, catching up on all elapsed time at once, either every
+    COARSE_INTERVAL seconds or as soon as the drone comes close. Gas from a coarse tile can never
+    reach the drone, since ACTIVE_RADIUS covers the furthest a particle can drift in its lifetime
+    """
+    tile_size: float
+    tiles: dict[tuple[int, int], Tile]
+
+    TILE_SIZE = 5.0  # m
+    ACTIVE_RADIUS = 6.0  # m from drone center to a tile for it to be fully simulated
+    COARSE_INTERVAL = 2.0  # s of sim time between catch-up updates of far tiles
+
+    def __init__(self, walls: np.ndarray, pipes: list, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.tiles = {}
+        self._schedule = []  # Heap of (due time, tile key) for coarse updates
+
+        # A wall is listed in every tile its bounding box overlaps
+        if len(walls):
+            low = np.floor(np.minimum(walls[:, :2], walls[:, 2:]) / tile_size).astype(int)
+            high = np.floor(np.maximum(walls[:, :2], walls[:, 2:]) / tile_size).astype(int)
+            ids = {}
+            for i, (c0, r0, c1, r1) in enumerate(np.hstack((low, high)).tolist()):
+                for col in range(c0, c1 + 1):
+                    for row in range(r0, r1 + 1):
+                        ids.setdefault((col, row), []).append(i)
+            for key, wall_ids in ids.items():
+                self._get_tile(key).wall_ids = np.array(wall_ids, dtype=np.intp)
+
+        for pipe in pipes:
+            tile = self._get_tile(self.tile_key(point_along_vector(pipe.vec, 0.5)))
+            tile.pipes.append(pipe)
+            self._queue(tile, 0.0)
+
+    def tile_key(self, point: Point) -> tuple[int, int]:
+        """Return key of the tile containing point"""
+        return math.floor(point.x / self.tile_size), math.floor(point.y / self.tile_size)
+
+    def _get_tile(self, key: tuple[int, int]) -> Tile:
+        if key not in self.tiles:
+            self.tiles[key] = Tile(key)
+        return self.tiles[key]
+
+    def _queue(self, tile: Tile, now: float) -> None:
+        if not tile.scheduled:
+            tile.scheduled = True
+            heapq.heappush(self._schedule, (now + TiledWorld.COARSE_INTERVAL, tile.key))
+
+    def tiles_near(self, point: Point, radius: float) -> list[Tile]:
+        """Return existing tiles overlapping the square of half-width radius around point"""
+        c0 = math.floor((point.x - radius) / self.tile_size)
+        c1 = math.floor((point.x + radius) / self.tile_size)
+        r0 = math.floor((point.y - radius) / self.tile_size)
+        r1 = math.floor((point.y + radius) / self.tile_size)
+        return [self.tiles[(c, r)] for c in range(c0, c1 + 1) for r in range(r0, r1 + 1) if (c, r) in self.tiles]
+
+    def walls_near(self, point: Point, radius: float) -> np.ndarray:
+        """Return indices of walls that may lie within radius of point"""
+        ids = [tile.wall_ids for tile in self.tiles_near(point, radius) if len(tile.wall_ids)]
+        if not ids:
+            return np.zeros(0, dtype=np.intp)
+        return np.unique(np.concatenate(ids)) if len(ids) > 1 else ids[0]
+
+    def add_leak(self, leak, now: float) -> None:
+        """Place a new leak into the tile holding its emitter"""
+        tile = self._get_tile(self.tile_key(leak.emitter_loc))
+        if not tile.pipes and not tile.leaks:
+            # Fresh tile, nothing happened in it before now
+            tile.last_update = now
+        tile.leaks.append(leak)
+        self._queue(tile, now)
+
+    def remove_leak(self, leak) -> None:
+        """Take a retired leak out of its tile"""
+        self.tiles[self.tile_key(leak.emitter_loc)].leaks.remove(leak)
+
+    def update(self, sim, now: float) -> list:
+        """Advance tiles near the drone fully and far tiles that are due coarsely. Return new leaks"""
+        new_leaks = []
+        active = self.tiles_near(sim.drone.pos, TiledWorld.ACTIVE_RADIUS)
+        sim.profiler.gauge("active_tiles", len(active))
+        active_keys = set()
+        for tile in active:
+            active_keys.add(tile.key)
+            new_leaks.extend(tile.advance(sim, now, full=True))
+
+        while self._schedule and self._schedule[0][0] <= now:
+            _, key = heapq.heappop(self._schedule)
+            tile = self.tiles[key]
+            tile.scheduled = False
+            if key not in active_keys:
+                new_leaks.extend(tile.advance(sim, now, full=False))
+            self._queue(tile, now)
+        return new_leaks
@@ -0,0 +1,204 @@
+"""Benchmarks for the geometry helpers and for stepping a headless Sim.
+
+    python3 benchmark.py run -o before.json          # Run all benchmarks
+    python3 benchmark.py run -o quick.json --quick   # Smaller sweeps, fewer repeats
+    python3 benchmark.py compare before.json after.json --threshold 0.1
+
+compare exits with status 1 if any benchmark got slower by more than the threshold
+"""
+from __future__ import annotations
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+from typing import Callable
+import numpy as np
+from geometry.geometry import Point, Vector, Rectangle
+from geometry.helpers import are_vectors_intersecting, roll_probability, scale_probability
+from Sim import Sim, Leak
+from generate import generate_building
+from Sharding import ShardedSim
+
+SEED = 1234
+TICK = 1 / 60
+AREA = 100.0  # Side (m) of the square synthetic scenes are spread over
+PARTICLES_PER_LEAK = 100  # Particles each leak holds when a sweep doesn't set the particle count
+
+
+def time_per_call(func: Callable[[], object], number: int, repeat: int) -> list[float]:
+    """Return seconds per call of func for each of repeat batches of number calls"""
+    return [t / number for t in timeit.repeat(func, number=number, repeat=repeat)]
+
+
+def micro_benchmarks(repeat: int) -> dict[str, Callable[[], list[float]]]:
+    """Return benchmark name to a function running it"""
+    p, q = Point(1.5, -2.0), Point(0.25, 3.0)
+    v1 = Vector(Point(-1.0, -1.0), Point(1.0, 1.0))
+    v2 = Vector(Point(-1.0, 1.0), Point(1.0, -1.0))
+    rect = Rectangle(left=-0.5, top=-0.5, width=1.0, height=1.0)
+    miss = Vector(Point(2.0, 2.0), Point(3.0, 4.0))
+    return {
+        "point_add": lambda: time_per_call(lambda: p + q, 100000, repeat),
+        "point_mul": lambda: time_per_call(lambda: p * 2.5, 100000, repeat),
+        "are_vectors_intersecting": lambda: time_per_call(lambda: are_vectors_intersecting(v1, v2), 50000, repeat),
+        "rectangle_is_vector_intersect_hit": lambda: time_per_call(lambda: rect.is_vector_intersect(v1), 20000, repeat),
+        "rectangle_is_vector_intersect_miss": lambda: time_per_call(lambda: rect.is_vector_intersect(miss), 20000, repeat),
+        "roll_probability": lambda: time_per_call(lambda: roll_probability(0.0123456789), 50000, repeat),
+        "scale_probability": lambda: time_per_call(lambda: scale_probability(0.999, 60, TICK, 10), 100000, repeat),
+    }
+
+
+def random_segments(count: int, max_length: float) -> np.ndarray:
+    """Return count random segments as an (n, 4) array spread over AREA"""
+    rng = np.random.default_rng(SEED)
+    start = rng.uniform(-AREA / 2, AREA / 2, (count, 2))
+    return np.hstack((start, start + rng.uniform(-max_length, max_length, (count, 2))))
+
+
+def make_sim(walls=0, pipes=0, leaks=0, particles=0) -> Sim:
+    """Return a headless sim with the given amount of each thing, with the drone moving through it.
+    Particles are split evenly between leaks (or one leak if there are none). If particles is 0 each
+    leak gets PARTICLES_PER_LEAK, so sweeping leaks also measures the particles they carry"""
+    random.seed(SEED)
+    sim = Sim(random_segments(walls, 2.0), random_segments(pipes, 2.0), Point(0.0, 0.0))
+    sim.notify_server = lambda leak_pos: None  # Benchmarks must not hit the network
+
+    rng = np.random.default_rng(SEED)
+    n_leaks = max(leaks, 1 if particles else 0)
+    for x, y in rng.uniform(-5.0, 5.0, (n_leaks, 2)).tolist():
+        sim.add_leak(Leak(Point(x, y)))
+    count = particles // n_leaks if particles else PARTICLES_PER_LEAK
+    for leak in sim.leaks:
+        leak.particle_pos = np.tile((leak.emitter_loc.x, leak.emitter_loc.y), (count, 1))
+        leak.particle_vel = rng.uniform(-0.18, 0.18, (count, 2))
+        leak.particle_age = rng.uniform(0.0, 1.0, count)
+        leak.frequency = 0.0  # Hold the particle count steady
+
+    sim.drone.velocity = Point(1.0, 0.5)
+    return sim
+
+
+def make_building_sim(size: float) -> Sim:
+    """Return a headless sim of a generated size by size meter building, drone at the first start"""
+    random.seed(SEED)
+    scene = generate_building(size, size, SEED)
+    sim = Sim(scene.walls, scene.pipes, Point(*scene.drone_starts[0]))
+    sim.notify_server = lambda leak_pos: None
+    sim.drone.velocity = Point(1.0, 0.5)
+    return sim
+
+
+def time_sharded_ticks(size: float, shards: int, ticks: int, repeat: int) -> list[float]:
+    """Return seconds per tick of a generated size by size meter building split over shards workers"""
+    scene = generate_building(size, size, SEED)
+    sim = ShardedSim(scene.walls, scene.pipes, Point(*scene.drone_starts[0]), shards=shards, seed=SEED)
+    sim.notify_server = lambda leak_pos: None
+    sim.drone.velocity = Point(1.0, 0.5)
+    try:
+        return time_ticks(sim, ticks, repeat)
+    finally:
+        sim.close()
+
+
+def time_ticks(sim: Sim, ticks: int, repeat: int) -> list[float]:
+    """Return seconds per tick of sim for each of repeat batches of ticks"""
+    sim.update(TICK)  # Warm up
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(ticks):
+            sim.update(TICK)
+        runs.append((time.perf_counter() - start) / ticks)
+    return runs
+
+
+def macro_benchmarks(repeat: int, quick: bool) -> dict[str, Callable[[], list[float]]]:
+    """Return benchmark name to a function running it, sweeping the size of each part of the scene"""
+    scale = (1, 10, 100) if quick else (1, 10, 100, 1000)
+    ticks = 20 if quick else 100
+    benches = {}
+    for n in scale:
+        benches["tick_walls_" + str(n * 100)] = lambda n=n: time_ticks(make_sim(walls=n * 100), ticks, repeat)
+        benches["tick_pipes_" + str(n * 10)] = lambda n=n: time_ticks(make_sim(pipes=n * 10), ticks, repeat)
+        benches["tick_leaks_" + str(n)] = lambda n=n: time_ticks(make_sim(leaks=n), ticks, repeat)
+        benches["tick_particles_" + str(n * 100)] = lambda n=n: time_ticks(make_sim(particles=n * 100), ticks, repeat)
+    for size in ((30, 100) if quick else (30, 100, 300)):
+        benches["tick_building_" + str(size)] = lambda size=size: time_ticks(make_building_sim(size), ticks, repeat)
+    size = 100 if quick else 300
+    for shards in (1, 2, 4):
+        benches["tick_sharded_building_{}_x{}".format(size, shards)] = \
+            lambda shards=shards: time_sharded_ticks(size, shards, ticks, repeat)
+    return benches
+
+
+def run(out_path: str, quick: bool, only: str = None) -> None:
+    repeat = 3 if quick else 5
+    benches = {**micro_benchmarks(repeat), **macro_benchmarks(repeat, quick)}
+    results = {}
+    for name, bench in benches.items():
+        if only is not None and only not in name:
+            continue
+        runs = bench()
+        results[name] = {"best": min(runs), "median": float(np.median(runs)), "runs": runs}
+        print("{:<40} {:>12.3f} us".format(name, min(runs) * 1e6))
+
+    with open(out_path, "w") as file:
+        json.dump({
+            "meta": {
+                "time": time.time(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.platform(),
+                "quick": quick,
+            },
+            "results": results,
+        }, file, indent=2)
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> bool:
+    """Print the change of each benchmark present in both runs, return False if any regressed
+    by more than threshold (as a fraction of the old time)"""
+    with open(old_path) as file:
+        old = json.load(file)["results"]
+    with open(new_path) as file:
+        new = json.load(file)["results"]
+
+    ok = True
+    for name in sorted(old.keys() & new.keys()):
+        change = new[name]["best"] / old[name]["best"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "REGRESSION"
+            ok = False
+        elif change < -threshold:
+            flag = "faster"
+        print("{:<40} {:>12.3f} us {:>12.3f} us {:>+8.1%} {}".format(
+            name, old[name]["best"] * 1e6, new[name]["best"] * 1e6, change, flag))
+    for name in sorted(old.keys() ^ new.keys()):
+        print("{:<40} only in {}".format(name, old_path if name in old else new_path))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipro benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and save results as JSON")
+    run_parser.add_argument("-o", "--output", default="bench.json")
+    run_parser.add_argument("--quick", action="store_true", help="smaller sweeps and fewer repeats")
+    run_parser.add_argument("-k", dest="only", help="only run benchmarks whose name contains this")
+
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="slowdown fraction counted as a regression (default 0.1)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args.output, args.quick, args.only)
+    elif not compare(args.old, args.new, args.threshold):
+        sys.exit(1)
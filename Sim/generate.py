@@ -0,0 +1,138 @@
+"""Seeded generator of building floorplans with pipe networks, for testing the sim at scale.
+
+    python3 generate.py configs/office.json --width 60 --height 40 --seed 7
+    python3 generate.py configs/site.scene --width 1000 --height 1000 --binary
+
+The same seed and parameters always give the same building
+"""
+from __future__ import annotations
+import argparse
+import random
+import numpy as np
+from Scene import Scene
+
+MIN_ROOM = 4.0  # Smallest side (m) a room is split down to
+MAX_ROOM = 12.0  # Rooms bigger than this on either side are always split
+DOOR_WIDTH = 1.0
+CORRIDOR_WIDTH = 2.0
+CORRIDOR_MIN_SPAN = 30.0  # Regions at least this long along the split get a corridor instead of a wall
+CORRIDOR_DOOR_SPACING = 6.0  # Corridor walls get a doorway every this many meters on average
+PIPE_OFFSET = 0.3  # Distance of pipe runs from the wall they follow
+PIPE_PROB = 0.6  # Probability a room has a pipe run
+ROOMS_PER_DRONE = 50
+
+
+def _wall_with_doors(walls: list, fixed: float, start: float, end: float,
+                     doors: list[float], vertical: bool) -> None:
+    """Add a wall along one axis from start to end at coordinate fixed, leaving a DOOR_WIDTH gap
+    centered at each position in doors"""
+    pos = start
+    for center in sorted(doors):
+        gap_start, gap_end = center - DOOR_WIDTH / 2, center + DOOR_WIDTH / 2
+        if gap_start > pos:
+            walls.append((fixed, pos, fixed, gap_start) if vertical else (pos, fixed, gap_start, fixed))
+        pos = max(pos, gap_end)
+    if end > pos:
+        walls.append((fixed, pos, fixed, end) if vertical else (pos, fixed, end, fixed))
+
+
+def _door_positions(rng: random.Random, start: float, end: float, count: int) -> list[float]:
+    """Return count doorway centers spread between start and end, clear of the ends"""
+    low, high = start + DOOR_WIDTH, end - DOOR_WIDTH
+    if high <= low:
+        return [(start + end) / 2]
+    return [rng.uniform(low + (high - low) * i / count, low + (high - low) * (i + 1) / count) for i in range(count)]
+
+
+def _room_pipes(rng: random.Random, pipes: list, room: tuple[float, float, float, float]) -> None:
+    """Maybe run a pipe along one or two adjoining walls of room, as one or two segments"""
+    if rng.random() > PIPE_PROB:
+        return
+    left, top, right, bottom = room
+    left, top, right, bottom = left + PIPE_OFFSET, top + PIPE_OFFSET, right - PIPE_OFFSET, bottom - PIPE_OFFSET
+    corners = [(left, top), (right, top), (right, bottom), (left, bottom)]
+    first = rng.randrange(4)
+    # Start somewhere along one wall and run to its corner, possibly turning onto the next wall
+    a, b = corners[first], corners[(first + 1) % 4]
+    t = rng.uniform(0.0, 0.6)
+    start = (a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t)
+    pipes.append((*start, *b))
+    if rng.random() < 0.5:
+        c = corners[(first + 2) % 4]
+        t = rng.uniform(0.3, 1.0)
+        pipes.append((*b, b[0] + (c[0] - b[0]) * t, b[1] + (c[1] - b[1]) * t))
+
+
+def generate_building(width: float, height: float, seed: int = 0) -> Scene:
+    """Return a building of width by height meters, with its top left corner at the origin.
+
+    The outline is recursively split into rooms (binary space partitioning). Long splits become
+    corridors lined with doorways, short ones become a wall with one doorway, so every room can be
+    reached from every other. Some rooms get pipe runs along their walls, and drones start in the
+    center of every ROOMS_PER_DRONE-th room"""
+    rng = random.Random(seed)
+    walls = []
+    pipes = []
+    rooms = []
+
+    # Outer walls, with an entrance on the bottom side
+    _wall_with_doors(walls, 0.0, 0.0, width, [], vertical=False)
+    _wall_with_doors(walls, height, 0.0, width, _door_positions(rng, 0.0, width, 1), vertical=False)
+    _wall_with_doors(walls, 0.0, 0.0, height, [], vertical=True)
+    _wall_with_doors(walls, width, 0.0, height, [], vertical=True)
+
+    regions = [(0.0, 0.0, width, height)]
+    while regions:
+        left, top, right, bottom = regions.pop()
+        w, h = right - left, bottom - top
+        can_split_x, can_split_y = w >= 2 * MIN_ROOM, h >= 2 * MIN_ROOM
+        must_split = w > MAX_ROOM or h > MAX_ROOM
+        if not (can_split_x or can_split_y) or (not must_split and rng.random() < 0.3):
+            rooms.append((left, top, right, bottom))
+            continue
+
+        # Split across the longer side, so rooms stay roughly square
+        vertical = can_split_x and (w >= h or not can_split_y)
+        low, high = (left, right) if vertical else (top, bottom)
+        span_start, span_end = (top, bottom) if vertical else (left, right)
+        span = span_end - span_start
+
+        if span >= CORRIDOR_MIN_SPAN and high - low >= 2 * MIN_ROOM + CORRIDOR_WIDTH:
+            at = rng.uniform(low + MIN_ROOM, high - MIN_ROOM - CORRIDOR_WIDTH)
+            doors = max(1, round(span / CORRIDOR_DOOR_SPACING))
+            for side in (at, at + CORRIDOR_WIDTH):
+                _wall_with_doors(walls, side, span_start, span_end,
+                                 _door_positions(rng, span_start, span_end, doors), vertical)
+            first_end, second_start = at, at + CORRIDOR_WIDTH
+        else:
+            at = rng.uniform(low + MIN_ROOM, high - MIN_ROOM)
+            _wall_with_doors(walls, at, span_start, span_end, _door_positions(rng, span_start, span_end, 1), vertical)
+            first_end, second_start = at, at
+
+        if vertical:
+            regions += [(left, top, first_end, bottom), (second_start, top, right, bottom)]
+        else:
+            regions += [(left, top, right, first_end), (left, second_start, right, bottom)]
+
+    for room in rooms:
+        _room_pipes(rng, pipes, room)
+    starts = [((l + r) / 2, (t + b) / 2) for l, t, r, b in rooms[::ROOMS_PER_DRONE]]
+
+    return Scene(np.array(walls), np.array(pipes), np.array(starts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a building floorplan with pipes")
+    parser.add_argument("output", help="file to write, JSON config unless --binary")
+    parser.add_argument("--width", type=float, default=40.0)
+    parser.add_argument("--height", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--binary", action="store_true", help="write the packed .scene format instead of JSON")
+    args = parser.parse_args()
+
+    scene = generate_building(args.width, args.height, args.seed)
+    if args.binary:
+        scene.save(args.output)
+    else:
+        scene.to_json(args.output)
+    print("{} walls, {} pipes, {} drone starts".format(len(scene.walls), len(scene.pipes), len(scene.drone_starts)))
@@ -236,9 +236,10 @@ class Circle:
         self.radius = radius
 
     def is_vector_intersect(self, vector: Vector) -> bool:
-        """Return if vector intersects the circle, tangent line should be false"""
-        # TODO: This algorithm is not done. Review projection approach on iPad
-        return False
+        """Return if vector intersects the circle, tangent line should be false. A vector lying
+        entirely inside the circle counts as intersecting"""
+        center = Point(self.center_x, self.center_y)
+        return dist(center, closest_point_on_segment(center, vector)) < self.radius
 
     def get_inflated(self, radius: float) -> Circle:
         """
@@ -17,9 +17,10 @@ This file is Copyright (c) 2022 Aleksey Panas.
 from __future__ import annotations
 import math
 import geometry.geometry as g
-from typing import Union, Callable
+from typing import Union, Callable, Optional
 import random
 import colorsys
+import numpy as np
 
 SECONDS_IN_YEAR = 31536000
 
@@ -44,6 +45,72 @@ def point_along_vector(vector: g.Vector, dist_ratio: float) -> g.Point:
     return vector.start + ((vector.end - vector.start) * dist_ratio)
 
 
+def dot(p: g.Point, q: g.Point) -> float:
+    """Return the dot product of 2 points treated as vectors from the origin"""
+    return p.x * q.x + p.y * q.y
+
+
+def closest_point_on_segment(point: g.Point, vector: g.Vector) -> g.Point:
+    """Return the point on the vector's segment which is closest to point"""
+    seg = vector.end - vector.start
+    length_sq = dot(seg, seg)
+    if length_sq == 0:
+        return vector.start
+    ratio = min(max(dot(point - vector.start, seg) / length_sq, 0.0), 1.0)
+    return point_along_vector(vector, ratio)
+
+
+def swept_circle_impact(center: g.Point, displacement: g.Point, radius: float,
+                        segment: g.Vector) -> Optional[tuple[float, g.Point]]:
+    """Given a circle moving from center by displacement, return (t, normal) for its first contact with
+    the segment, where t in [0, 1] is the fraction of the displacement travelled at impact and normal is
+    the unit vector pointing from the segment towards the circle. Return None if they never touch.
+
+    A circle that already overlaps the segment reports an impact at t=0 only if it is moving further in,
+    so that it is always free to move out"""
+    closest = closest_point_on_segment(center, segment)
+    offset = center - closest
+    if dot(offset, offset) < radius ** 2:
+        # Exactly on the segment has no defined normal, moving anywhere is allowed
+        if dot(displacement, offset) >= 0:
+            return None
+        return 0.0, offset / dist(center, closest)
+
+    hits = []
+    seg = segment.end - segment.start
+    length = dist(segment.start, segment.end)
+
+    # Contact with the flat side: the circle reaches radius distance from the segment's line
+    if length > 0:
+        normal = g.Point(-seg.y, seg.x) / length
+        side = dot(center - segment.start, normal)
+        approach = dot(displacement, normal)
+        if side * approach < 0:
+            if side < 0:
+                normal = normal * -1
+            t = (abs(side) - radius) / abs(approach)
+            if 0 <= t <= 1:
+                contact = center + displacement * t
+                ratio = dot(contact - segment.start, seg) / (length ** 2)
+                if 0 <= ratio <= 1:
+                    hits.append((t, normal))
+
+    # Contact with either rounded end
+    a = dot(displacement, displacement)
+    if a > 0:
+        for endpoint in segment:
+            rel = center - endpoint
+            b = 2 * dot(rel, displacement)
+            c = dot(rel, rel) - radius ** 2
+            disc = b ** 2 - 4 * a * c
+            if disc >= 0:
+                t = (-b - disc ** 0.5) / (2 * a)
+                if 0 <= t <= 1:
+                    hits.append((t, (rel + displacement * t) / radius))
+
+    return min(hits, key=lambda h: h[0]) if hits else None
+
+
 def intersect_points(a: g.Point, b: g.Point, c: g.Point, d: g.Point) -> bool:
     """Return if segments formed by points AB and CD are intersecting"""
     return ccw(a, c, d) != ccw(b, c, d) and ccw(a, b, c) != ccw(a, b, d)
@@ -61,6 +128,51 @@ def are_vectors_intersecting(vector1: g.Vector, vector2: g.Vector) -> bool:
         intersect_points(vector1.end, vector1.start, vector2.end, vector2.start)
 
 
+def segments_intersecting_array(a: np.ndarray, b: np.ndarray,
+                                c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """Vectorized form of segment intersection for arrays of points shaped (..., 2). Return a
+    boolean array telling, for each pair, whether segment AB meets segment CD. Inputs broadcast
+    against each other. Unlike are_vectors_intersecting, touching at endpoints and overlapping
+    collinear segments DO count as intersecting"""
+    def orientation(p, q, r):
+        return (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - \
+            (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+
+    d1 = orientation(c, d, a)
+    d2 = orientation(c, d, b)
+    d3 = orientation(a, b, c)
+    d4 = orientation(a, b, d)
+    crossing = (d1 * d2 <= 0) & (d3 * d4 <= 0)
+
+    # Collinear segments pass the orientation test even when far apart, so require their boxes overlap
+    collinear = (d1 == 0) & (d2 == 0)
+    overlapping = (np.minimum(a[..., 0], b[..., 0]) <= np.maximum(c[..., 0], d[..., 0])) & \
+        (np.minimum(c[..., 0], d[..., 0]) <= np.maximum(a[..., 0], b[..., 0])) & \
+        (np.minimum(a[..., 1], b[..., 1]) <= np.maximum(c[..., 1], d[..., 1])) & \
+        (np.minimum(c[..., 1], d[..., 1]) <= np.maximum(a[..., 1], b[..., 1]))
+    return crossing & (~collinear | overlapping)
+
+
+def vectors_to_array(vectors: Union[list[g.Vector], np.ndarray]) -> np.ndarray:
+    """Return segments as an (n, 4) array of x1, y1, x2, y2 rows. Arrays are passed through uncopied"""
+    if isinstance(vectors, np.ndarray):
+        return vectors.reshape(-1, 4)
+    return np.array([(v.start.x, v.start.y, v.end.x, v.end.y) for v in vectors], dtype=np.float64).reshape(-1, 4)
+
+
+def distance_to_segments_array(point: g.Point, segments: np.ndarray) -> np.ndarray:
+    """Return the distance from point to each segment of an (n, 4) array of x1, y1, x2, y2 rows"""
+    start = segments[:, :2]
+    seg = segments[:, 2:] - start
+    rel = np.array((point.x, point.y)) - start
+    length_sq = np.einsum("ij,ij->i", seg, seg)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.clip(np.einsum("ij,ij->i", rel, seg) / length_sq, 0.0, 1.0)
+    ratio[length_sq == 0] = 0.0
+    offset = rel - seg * ratio[:, None]
+    return np.sqrt(np.einsum("ij,ij->i", offset, offset))
+
+
 def average(values: Union[list[int], tuple[int, ...], set[int]]):
     """Returns average, duh"""
     return sum(values) / len(values)
@@ -121,6 +233,30 @@ def distance_func_between_vectors(v1: g.Vector, v2: g.Vector, delta_time_s: floa
     return lambda time: ((r1*time + r2) ** 2 + (r3*time + r4) ** 2) ** 0.5
 
 
+def closest_approach(rel_start: np.ndarray, rel_delta: np.ndarray,
+                     radius: float) -> tuple[np.ndarray, np.ndarray]:
+    """Closed-form counterpart to distance_func_between_vectors, vectorized over many objects.
+
+    Given (n, 2) arrays of relative positions at the start of an interval and relative
+    displacements over it, so that the separation is rel_start + rel_delta * t for t in [0, 1],
+    return (within, entry) where within[i] tells whether object i came within radius at some
+    point in the interval and entry[i] is the earliest such t (inf where it never did)"""
+    a = np.einsum("ij,ij->i", rel_delta, rel_delta)
+    b = np.einsum("ij,ij->i", rel_start, rel_delta)
+    c = np.einsum("ij,ij->i", rel_start, rel_start) - radius ** 2
+
+    # Roots of |rel_start + rel_delta * t|^2 = radius^2, i.e. a*t^2 + 2*b*t + c = 0
+    disc = b ** 2 - a * c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        first_root = (-b - np.sqrt(disc)) / a
+    entering = (a > 0) & (disc >= 0) & (first_root >= 0) & (first_root <= 1)
+
+    entry = np.full(len(a), np.inf)
+    entry[entering] = first_root[entering]
+    entry[c <= 0] = 0.0  # Already in range at the start of the interval
+    return np.isfinite(entry), entry
+
+
 def get_shuffled(lst: list) -> list:
     """random.shuffle but returns a copy of the shuffled list"""
     lst = [e for e in lst]
@@ -150,6 +286,29 @@ def roll_probability(prob: float) -> bool:
     return random.randint(1, total) <= prob
 
 
+def roll_count(mean: float, cap: int) -> int:
+    """
+    Roll how many events of a Poisson process happen in an interval where mean are expected,
+    counting at most cap
+
+    Preconditions:
+        - mean >= 0
+    """
+    count = 0
+    elapsed = random.expovariate(1.0)
+    while elapsed < mean and count < cap:
+        count += 1
+        elapsed += random.expovariate(1.0)
+    return count
+
+
+def probability_rate(pc: float, sc: float) -> float:
+    """Given a probability of pc, which is the probability of an event occurring
+    within a time interval of sc seconds, return the rate (events per second) of the
+    Poisson process it describes"""
+    return -math.log(1 - pc) / sc if pc < 1 else math.inf
+
+
 def scale_probability(pc: float, sc: float, sn: float, accuracy=3) -> float:
     """Given a probability of pc, which is the probability of an event occurring
     within a time interval of sc seconds, return the probability of the event
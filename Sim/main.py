@@ -1,31 +1,53 @@
+import argparse
+import cProfile
+import pstats
 import pygame
 import time
 from geometry.geometry import Point, Vector, Rectangle
 from App import App
-import json
+from Sim import Sim
+from Scene import Scene
+from Replay import ReplayLog
+from Outbox import Outbox
+from Telemetry import TelemetryReporter
 import os
 
-walls = []
-pipes = []
-start_pos = Point(0.0, 0.0)
-
+# Either a JSON config or a binary .scene file converted with Scene.py
 FILENAME = 'test_config.json'
+GAS_MODE = Sim.GAS_PARTICLES  # Or Sim.GAS_FIELD for the concentration grid
+REPLAY_FILENAME = None  # Set to e.g. 'run.replay' to record the run
+OUTBOX_FILENAME = 'outbox.jsonl'  # Leak notifications wait here until the server has them
 
-with open(os.path.join(os.path.dirname(__file__), 'configs', FILENAME), 'r') as file:
-    loaded_json = json.load(file)
+parser = argparse.ArgumentParser(description="Run the Pipro drone simulation")
+parser.add_argument("--profile", nargs="?", const="sim.prof", metavar="OUTFILE",
+                    help="run under cProfile, saving results to OUTFILE (default sim.prof)")
+parser.add_argument("--stats", metavar="OUTFILE",
+                    help="record per-phase timers and counters, appending them to OUTFILE as JSON lines")
+args = parser.parse_args()
 
-    for w in loaded_json["walls"]:
-        walls.append(Vector(
-            Point(w["start"]["x"], w["start"]["y"]),
-            Point(w["end"]["x"], w["end"]["y"])
-        ))
+scene = Scene.open(os.path.join(os.path.dirname(__file__), 'configs', FILENAME))
+start_pos = Point(*scene.drone_starts[0])
 
-    for p in loaded_json["pipes"]:
-        pipes.append(Vector(
-            Point(p["start"]["x"], p["start"]["y"]),
-            Point(p["end"]["x"], p["end"]["y"])
-        ))
+app = App((.6, .6), scene.walls, scene.pipes, start_pos, GAS_MODE)
+if REPLAY_FILENAME is not None:
+    app.sim.replay = ReplayLog(REPLAY_FILENAME)
+app.sim.outbox = Outbox(OUTBOX_FILENAME, Sim.BATCH_POST_URL)
+app.sim.telemetry = TelemetryReporter(Sim.TELEMETRY_URL)
+if args.stats is not None:
+    app.sim.profiler.enabled = True
+    app.sim.profiler.dump_path = args.stats
 
-    start_pos = Point(loaded_json["drone_start"]["x"], loaded_json["drone_start"]["y"])
+if args.profile is not None:
+    profile = cProfile.Profile()
+    profile.runcall(app.start)
+    profile.dump_stats(args.profile)
+    pstats.Stats(profile).sort_stats("cumulative").print_stats(25)
+else:
+    app.start()
 
-App((.6, .6), walls, pipes, start_pos).start()
+app.sim.outbox.stop()
+app.sim.telemetry.stop()
+if args.stats is not None:
+    app.sim.profiler.dump()
+if REPLAY_FILENAME is not None:
+    app.sim.replay.close()
@@ -0,0 +1,303 @@
+"""Search for patrol routes or sensor positions that find leaks soonest, by simulating many
+seeded leak scenarios.
+
+    python3 optimize.py routes configs/test_config.json --scenarios 20 --generations 15
+    python3 optimize.py routes configs/office.json --routes seeds.json -o best_routes.json
+    python3 optimize.py sensors configs/office.json --count 3 --candidates 60
+
+A scenario is a seed giving a few leaks at random points along the pipes, each starting at a
+random time. A candidate is scored by the latency from each leak starting until gas reaches the
+drone, with leaks never found counted as found at the end of the scenario. Routes are closed loops
+flown at SPEED, searched with a simple evolutionary loop. A stationary sensor is a route of one
+point, and sensors are placed greedily one at a time. Results for a candidate in a scenario are
+memoized, so survivors and sensor combinations are never simulated twice
+"""
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing
+import os
+import random
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from geometry.geometry import Point, Path
+from geometry.helpers import segments_intersecting_array
+from Sim import Sim, Leak
+from Events import GasDetected
+from Scene import Scene
+
+SPEED = 1.0  # m/s along patrol routes
+HORIZON = 120.0  # s simulated per scenario
+TICK = 0.1  # s per sim update, detection is swept along the drone's move so coarse ticks don't skip gas
+LEAKS_PER_SCENARIO = 3
+LATEST_START = 0.5  # Leaks start within this fraction of HORIZON
+MUTATION_STEP = 2.0  # m, standard deviation of a waypoint move
+MAX_TRIES = 20  # Attempts at a random or mutated route that doesn't cross a wall
+
+
+@dataclass
+class Scenario:
+    """Leaks, as (start time, x, y) sorted by start time, and the seed of the gas they emit"""
+    seed: int
+    leaks: list[tuple[float, float, float]]
+
+
+def make_scenarios(scene: Scene, count: int, seed=0) -> list[Scenario]:
+    """Return count scenarios of LEAKS_PER_SCENARIO leaks along the pipes of scene. Longer pipes
+    are more likely to leak"""
+    rng = np.random.default_rng(seed)
+    lengths = np.hypot(scene.pipes[:, 2] - scene.pipes[:, 0], scene.pipes[:, 3] - scene.pipes[:, 1])
+    scenarios = []
+    for i in range(count):
+        pipes = scene.pipes[rng.choice(len(scene.pipes), LEAKS_PER_SCENARIO, p=lengths / lengths.sum())]
+        along = rng.random((LEAKS_PER_SCENARIO, 1))
+        points = pipes[:, :2] + (pipes[:, 2:] - pipes[:, :2]) * along
+        starts = rng.uniform(0.0, HORIZON * LATEST_START, LEAKS_PER_SCENARIO)
+        leaks = sorted(zip(starts.tolist(), points[:, 0].tolist(), points[:, 1].tolist()))
+        scenarios.append(Scenario(seed * 100003 + i, leaks))
+    return scenarios
+
+
+def _route_key(route: Path) -> tuple:
+    return tuple((round(p.x, 3), round(p.y, 3)) for p in route)
+
+
+def crosses_walls(route: Path, walls: np.ndarray) -> bool:
+    """Return whether any leg of the closed route, including the one back to its start, crosses a wall"""
+    points = np.array(_route_key(route)).reshape(-1, 2)
+    if len(points) < 2 or len(walls) == 0:
+        return False
+    legs = np.hstack((points, np.roll(points, -1, axis=0)))[:, None, :]
+    return bool(segments_intersecting_array(legs[..., :2], legs[..., 2:], walls[None, :, :2], walls[None, :, 2:]).any())
+
+
+def simulate(walls: np.ndarray, key: tuple, scenario: Scenario) -> list[float]:
+    """Fly the closed route key through scenario and return the detection latency of each leak"""
+    points = np.array(key, dtype=float).reshape(-1, 2)
+    legs = np.roll(points, -1, axis=0) - points
+    ends = np.cumsum(np.hypot(legs[:, 0], legs[:, 1]))
+    length = ends[-1] if len(ends) else 0.0
+
+    def position(time: float) -> Point:
+        if length == 0:
+            return Point(*points[0])
+        s = (SPEED * time) % length
+        leg = int(np.searchsorted(ends, s, side="right"))
+        t = (s - (ends[leg - 1] if leg else 0.0)) / (ends[leg] - (ends[leg - 1] if leg else 0.0))
+        return Point(*(points[leg] + legs[leg] * t))
+
+    def fly(sim: Sim, time_delta: float) -> None:
+        """Stands in for the drone's physics, moving it along the route. prev_pos and pos are what
+        gas detection sweeps between, so the whole way flown in a tick is covered"""
+        sim.drone.prev_pos = sim.drone.pos
+        sim.drone.pos = position(sim.time + time_delta)
+
+    random.seed(scenario.seed)
+    sim = Sim(walls, np.zeros((0, 4)), position(0.0))
+    sim.drone.update = fly
+    sim.notify_server = lambda leak_pos: None
+    found = {}
+    sim.events.subscribe(GasDetected, lambda events: found.update((e.leak.id, e.time) for e in events))
+
+    pending = list(scenario.leaks)
+    while sim.time < HORIZON and len(found) < len(scenario.leaks):
+        while pending and pending[0][0] <= sim.time:
+            _, x, y = pending.pop(0)
+            sim.add_leak(Leak(Point(x, y)))
+        sim.update(TICK)
+
+    # Leak ids follow the order leaks were added, the order of scenario.leaks
+    return [found.get(i, HORIZON) - start for i, (start, _, _) in enumerate(scenario.leaks)]
+
+
+# Walls of the scene in each worker process, set once by _init_worker
+_walls = None
+
+
+def _init_worker(walls: np.ndarray) -> None:
+    global _walls
+    _walls = walls
+
+
+def _simulate_job(key: tuple, scenario: Scenario) -> list[float]:
+    return simulate(_walls, key, scenario)
+
+
+class Evaluator:
+    """Scores candidates over a fixed set of scenarios, simulating in parallel and remembering
+    the latencies of every (candidate, scenario) pair it has simulated
+
+    Instance Attributes
+        - scene: Scene candidates are flown in
+        - scenarios: Leak scenarios every candidate is scored over
+        - simulated: Number of (candidate, scenario) simulations run so far
+    """
+    scene: Scene
+    scenarios: list[Scenario]
+    simulated: int
+
+    def __init__(self, scene: Scene, scenarios: list[Scenario], workers: Optional[int] = None):
+        self.scene = scene
+        self.scenarios = scenarios
+        self.workers = workers or os.cpu_count() or 1
+        self.simulated = 0
+        self._memo = {}
+        self._pool = None
+
+    def latencies(self, routes: list[Path]) -> list[np.ndarray]:
+        """Return a (scenarios, leaks) array of detection latencies for each route"""
+        keys = [_route_key(route) for route in routes]
+        jobs = list({(key, i) for key in keys for i in range(len(self.scenarios)) if (key, i) not in self._memo})
+        if jobs:
+            args = [(key, self.scenarios[i]) for key, i in jobs]
+            if self.workers == 1:
+                results = [simulate(self.scene.walls, *arg) for arg in args]
+            else:
+                if self._pool is None:
+                    self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                                      initargs=(self.scene.walls,))
+                results = self._pool.starmap(_simulate_job, args)
+            self._memo.update(zip(jobs, results))
+            self.simulated += len(jobs)
+        return [np.array([self._memo[(key, i)] for i in range(len(self.scenarios))]) for key in keys]
+
+    def summarize(self, latencies: np.ndarray) -> dict:
+        """Return the score (mean latency, lower is better) and distribution of one candidate's latencies"""
+        never_found = np.array([[HORIZON - start for start, _, _ in scenario.leaks] for scenario in self.scenarios])
+        return {
+            "score": float(latencies.mean()),
+            "median": float(np.median(latencies)),
+            "p90": float(np.percentile(latencies, 90)),
+            "found": float((latencies < never_found).mean()),
+            "per_scenario": latencies.mean(axis=1).tolist(),
+        }
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def _bounds(scene: Scene) -> tuple[np.ndarray, np.ndarray]:
+    points = np.concatenate((scene.walls.reshape(-1, 2), scene.pipes.reshape(-1, 2)))
+    return points.min(axis=0), points.max(axis=0)
+
+
+def random_route(scene: Scene, rng: random.Random, size: int) -> Path:
+    """Return a random closed route of size waypoints within the scene that crosses no walls,
+    falling back to a single point"""
+    low, high = _bounds(scene)
+    for _ in range(MAX_TRIES):
+        route = Path([Point(rng.uniform(low[0], high[0]), rng.uniform(low[1], high[1])) for _ in range(size)])
+        if not crosses_walls(route, scene.walls):
+            return route
+    return Path([Point(rng.uniform(low[0], high[0]), rng.uniform(low[1], high[1]))])
+
+
+def mutate(route: Path, scene: Scene, rng: random.Random) -> Path:
+    """Return a copy of route with a waypoint moved, added or removed, that crosses no walls"""
+    for _ in range(MAX_TRIES):
+        points = list(route.points)
+        i = rng.randrange(len(points))
+        action = rng.random()
+        if action < 0.2 and len(points) > 2:
+            points.pop(i)
+        elif action < 0.4:
+            after = points[(i + 1) % len(points)]
+            points.insert(i + 1, Point((points[i].x + after.x) / 2 + rng.gauss(0, MUTATION_STEP),
+                                       (points[i].y + after.y) / 2 + rng.gauss(0, MUTATION_STEP)))
+        else:
+            points[i] = Point(points[i].x + rng.gauss(0, MUTATION_STEP), points[i].y + rng.gauss(0, MUTATION_STEP))
+        mutated = Path(points)
+        if not crosses_walls(mutated, scene.walls):
+            return mutated
+    return Path(list(route.points))
+
+
+def optimize_routes(evaluator: Evaluator, population=12, generations=10, seed=0,
+                    initial: Optional[list[Path]] = None) -> list[tuple[Path, dict]]:
+    """Evolve patrol routes, keeping the best third of each generation and filling the rest with
+    their mutants. Return the distinct routes of the final population as (route, summary) from
+    best to worst"""
+    rng = random.Random(seed)
+    scene = evaluator.scene
+    routes = list(initial or [])
+    routes += [random_route(scene, rng, rng.randint(3, 6)) for _ in range(population - len(routes))]
+
+    for generation in range(generations + 1):
+        scored = sorted(zip(evaluator.latencies(routes), routes), key=lambda pair: pair[0].mean())
+        print("Generation {}: best {:.1f} s, {} simulations".format(
+            generation, scored[0][0].mean(), evaluator.simulated))
+        if generation == generations:
+            break
+        parents = [route for _, route in scored[:max(1, population // 3)]]
+        routes = parents + [mutate(rng.choice(parents), scene, rng) for _ in range(population - len(parents))]
+    results = {}
+    for latencies, route in scored:
+        results.setdefault(_route_key(route), (route, evaluator.summarize(latencies)))
+    return list(results.values())
+
+
+def place_sensors(evaluator: Evaluator, candidates: list[Point], count: int) -> list[tuple[Point, dict]]:
+    """Greedily pick count stationary sensors from candidates, each time adding the one that most
+    lowers the latency of the sensors chosen so far. A leak is found by whichever sensor finds it
+    first, so sets are scored from the single sensor results without simulating again. Return each
+    sensor picked, in order, with the summary of the set up to it"""
+    latencies = evaluator.latencies([Path([point]) for point in candidates])
+    chosen = []
+    best = None
+    for _ in range(min(count, len(candidates))):
+        options = [(np.minimum(best, own) if best is not None else own, i)
+                   for i, own in enumerate(latencies) if i not in {j for j, _ in chosen}]
+        combined, i = min(options, key=lambda option: option[0].mean())
+        best = combined
+        chosen.append((i, evaluator.summarize(combined)))
+    return [(candidates[i], summary) for i, summary in chosen]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize patrol routes or sensor positions")
+    parser.add_argument("mode", choices=("routes", "sensors"))
+    parser.add_argument("scene", help="JSON config or .scene file")
+    parser.add_argument("--scenarios", type=int, default=20, help="seeded leak scenarios to score over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="processes to simulate with (default: one per core)")
+    parser.add_argument("--population", type=int, default=12, help="routes: routes per generation")
+    parser.add_argument("--generations", type=int, default=10, help="routes: generations to evolve")
+    parser.add_argument("--routes", help="routes: JSON list of routes, each a list of [x, y], to start from")
+    parser.add_argument("--count", type=int, default=3, help="sensors: sensors to place")
+    parser.add_argument("--candidates", type=int, default=40, help="sensors: random candidate positions")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--top", type=int, default=3, help="routes: best routes to report")
+    args = parser.parse_args()
+
+    scene = Scene.open(args.scene)
+    if len(scene.pipes) == 0:
+        parser.error("scene has no pipes to leak")
+    evaluator = Evaluator(scene, make_scenarios(scene, args.scenarios, args.seed), args.workers)
+    try:
+        if args.mode == "routes":
+            initial = None
+            if args.routes is not None:
+                with open(args.routes) as file:
+                    initial = [Path([Point(x, y) for x, y in route]) for route in json.load(file)]
+            results = optimize_routes(evaluator, args.population, args.generations, args.seed, initial)[:args.top]
+        else:
+            rng = random.Random(args.seed)
+            low, high = _bounds(scene)
+            candidates = [Point(rng.uniform(low[0], high[0]), rng.uniform(low[1], high[1]))
+                          for _ in range(args.candidates)]
+            results = place_sensors(evaluator, candidates, args.count)
+    finally:
+        evaluator.close()
+
+    for found, summary in results:
+        where = [tuple(round(v, 2) for v in point) for point in (found if isinstance(found, Path) else [found])]
+        print("{:>8.1f} s mean  {:>8.1f} s median  {:>8.1f} s p90  {:>4.0%} found   {}".format(
+            summary["score"], summary["median"], summary["p90"], summary["found"], where))
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump([{"points": [list(p) for p in (found if isinstance(found, Path) else [found])], **summary}
+                       for found, summary in results], file, indent=2)
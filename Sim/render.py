@@ -0,0 +1,169 @@
+"""Render a recorded run to an image sequence without a display, many times faster than real time.
+
+    python3 render.py run.replay configs/test_config.json frames/ --fps 30 --speed 4
+    python3 render.py run.replay configs/site.scene frames/ --follow 20 --workers 8
+
+Frames are split into ranges rendered in parallel by a process pool, and written as
+frames/frame_000000.png, frame_000001.png, ... which e.g. ffmpeg can turn into a video:
+
+    ffmpeg -framerate 30 -i frames/frame_%06d.png run.mp4
+"""
+from __future__ import annotations
+import argparse
+import multiprocessing
+import os
+from typing import Optional
+import numpy as np
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+from App import Camera
+from Replay import ReplayPlayer, ReplayFrame
+from Scene import Scene
+
+WALL_COLOR = (0, 255, 0)
+PIPE_COLOR = (255, 0, 0)
+DRONE_COLOR = (0, 0, 255)
+LEAK_COLORS = {"active": (255, 255, 0), "detected": (255, 128, 0), "repaired": (128, 128, 128)}
+DRONE_RADIUS = 0.1  # Not recorded, the Drone default
+LEAK_RADIUS = 0.1
+ENDPOINT_RADIUS = 4  # Pixels, as drawn by App
+MARGIN = 0.05  # Fraction of the scene size left around it when the camera is not following the drone
+
+
+class FrameRenderer:
+    """Draws frames of a recorded run onto an off-screen surface, as App draws the live sim.
+
+    With a fixed camera the walls and pipes never move, so they are drawn once and reused
+    for every frame
+
+    Instance Attributes
+        - scene: Static layout the run was recorded in
+        - camera: View drawn, moved to the drone every frame if follow is set
+        - follow: Width (m) of the view kept centered on the drone, None to show the whole scene
+        - surface: Frame being drawn
+    """
+    scene: Scene
+    camera: Camera
+    follow: Optional[float]
+    surface: pygame.Surface
+
+    def __init__(self, scene: Scene, size: tuple[int, int], follow: Optional[float] = None):
+        self.scene = scene
+        self.follow = follow
+        self.surface = pygame.Surface(size)
+        h_ratio = size[1] / size[0]
+
+        if follow is not None:
+            self.camera = Camera(0, 0, follow, h_ratio)
+            self._background = None
+        else:
+            points = np.concatenate((scene.walls.reshape(-1, 2), scene.pipes.reshape(-1, 2), scene.drone_starts))
+            low, high = points.min(axis=0), points.max(axis=0)
+            extent = high - low
+            center = (low + high) / 2
+            self.camera = Camera(center[0], center[1], max(extent[0], extent[1] / h_ratio) * (1 + 2 * MARGIN), h_ratio)
+            self._background = pygame.Surface(size)
+            self._draw_static(self._background)
+
+    def _draw_segments(self, target: pygame.Surface, segments: np.ndarray, color: tuple[int, int, int]) -> None:
+        width = target.get_width()
+        starts = self.camera.convert_array(segments[:, :2], width).tolist()
+        ends = self.camera.convert_array(segments[:, 2:], width).tolist()
+        for start, end in zip(starts, ends):
+            pygame.draw.line(target, color, start, end)
+            pygame.draw.circle(target, color, start, ENDPOINT_RADIUS, 1)
+            pygame.draw.circle(target, color, end, ENDPOINT_RADIUS, 1)
+
+    def _draw_static(self, target: pygame.Surface) -> None:
+        """Draw walls and pipes"""
+        target.fill((0, 0, 0))
+        self._draw_segments(target, self.scene.walls, WALL_COLOR)
+        self._draw_segments(target, self.scene.pipes, PIPE_COLOR)
+
+    def draw(self, frame: ReplayFrame) -> pygame.Surface:
+        """Draw frame and return the surface holding it"""
+        width = self.surface.get_width()
+        if self.follow is not None:
+            self.camera.x, self.camera.y = frame.drone_pos.x, frame.drone_pos.y
+            self._draw_static(self.surface)
+        else:
+            self.surface.blit(self._background, (0, 0))
+
+        if frame.leaks:
+            locs = self.camera.convert_array(np.array([tuple(loc) for loc in frame.leaks.values()]), width).tolist()
+            rad = self.camera.scale_quantity(LEAK_RADIUS, width)
+            for leak_id, loc in zip(frame.leaks, locs):
+                state = "repaired" if leak_id in frame.repaired else "detected" if leak_id in frame.detected else "active"
+                pygame.draw.circle(self.surface, LEAK_COLORS[state], loc, rad, 2)
+
+        pygame.draw.circle(self.surface, DRONE_COLOR, tuple(self.camera.convert_point(frame.drone_pos, width)),
+                           self.camera.scale_quantity(DRONE_RADIUS, width))
+        return self.surface
+
+    def to_array(self) -> np.ndarray:
+        """Return the current frame as a (height, width, 3) uint8 array"""
+        return pygame.surfarray.array3d(self.surface).swapaxes(0, 1)
+
+
+# Per worker process state, set up once by _init_worker
+_player = None
+_renderer = None
+
+
+def _init_worker(replay_path: str, scene_path: str, size: tuple[int, int], follow: Optional[float]) -> None:
+    global _player, _renderer
+    _player = ReplayPlayer(replay_path)
+    _renderer = FrameRenderer(Scene.open(scene_path), size, follow)
+
+
+def _render_range(out_dir: str, first: int, times: list[float]) -> int:
+    """Render frames numbered from first at the given times, return how many were written"""
+    for i, time in enumerate(times):
+        surface = _renderer.draw(_player.frame_at(time))
+        pygame.image.save(surface, os.path.join(out_dir, "frame_{:06d}.png".format(first + i)))
+    return len(times)
+
+
+def render_frames(replay_path: str, scene_path: str, out_dir: str, size=(1280, 720), fps=30.0, speed=1.0,
+                  follow: Optional[float] = None, workers: Optional[int] = None) -> int:
+    """Render a replay log to out_dir as PNG frames, fps per second of playback at speed times the
+    recorded sim time. Return the number of frames written"""
+    os.makedirs(out_dir, exist_ok=True)
+    times = ReplayPlayer(replay_path).frame_times(speed, fps)
+    workers = workers or os.cpu_count() or 1
+    # Several contiguous ranges per worker, so workers finishing early pick up more
+    chunks = np.array_split(np.arange(len(times)), workers * 4)
+    jobs = [(out_dir, int(chunk[0]), times[chunk].tolist()) for chunk in chunks if len(chunk)]
+
+    init_args = (replay_path, scene_path, size, follow)
+    if workers == 1:
+        _init_worker(*init_args)
+        return sum(_render_range(*job) for job in jobs)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args)
+    try:
+        count = sum(pool.starmap(_render_range, jobs))
+    finally:
+        # Let workers exit by themselves, SDL catches the SIGTERM Pool.terminate would send
+        pool.close()
+        pool.join()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a recorded run to PNG frames")
+    parser.add_argument("replay", help="replay log recorded by the sim")
+    parser.add_argument("scene", help="JSON config or .scene file the run was recorded in")
+    parser.add_argument("output", help="directory to write frames to")
+    parser.add_argument("--size", default="1280x720", help="frame size in pixels, WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--speed", type=float, default=1.0, help="sim seconds per second of playback")
+    parser.add_argument("--follow", type=float, metavar="WIDTH",
+                        help="keep a view WIDTH meters wide centered on the drone instead of showing the whole scene")
+    parser.add_argument("--workers", type=int, help="processes to render with (default: one per core)")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    count = render_frames(args.replay, args.scene, args.output, (width, height), args.fps, args.speed,
+                          args.follow, args.workers)
+    print("Wrote {} frames to {}".format(count, args.output))
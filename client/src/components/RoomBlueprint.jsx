@@ -4,6 +4,7 @@ import {
   pingCoordinates,
   wallCoordinates,
   pipeCoordinates,
+  pingsNear,
 } from "../utils/utils";
 
 const WIDTH = 500;
@@ -59,15 +60,18 @@ const RoomBlueprint = () => {
       p5.background("#000000");
       p5.scale(1, -1);
 
+      // All pings as one shape, so thousands of them are still a single draw call
+      p5.stroke("red");
+      p5.strokeWeight(10);
+      p5.beginShape(p5.POINTS);
       for (let i = 0; i < pingData.length; i++) {
         if (pingData[i].active) {
           let xPos = pingData[i].location[0] * SCALING_CONSTANT;
           let yPos = pingData[i].location[1] * SCALING_CONSTANT;
-          p5.stroke("red");
-          p5.strokeWeight(10);
-          p5.point(xPos, yPos);
+          p5.vertex(xPos, yPos);
         }
       }
+      p5.endShape();
 
       for (let j = 0; j < wallData.length; j++) {
         let vert1 = wallData[j].vert1;
@@ -102,19 +106,16 @@ const RoomBlueprint = () => {
     };
 
     p5.mousePressed = () => {
-      let success = false;
-      for (let i = 0; i < pingData.length; i++) {
-        if (!success) {
-          success = pingData[i].updatePing(
-            p5.mouseX - COORDINATE_ADJUST,
-            -(p5.mouseY - COORDINATE_ADJUST)
-          );
+      let mouseX = p5.mouseX - COORDINATE_ADJUST;
+      let mouseY = -(p5.mouseY - COORDINATE_ADJUST);
+      // Only the pings in the grid cells around the click are tested
+      let nearby = pingsNear(mouseX, mouseY);
+      for (let i = 0; i < nearby.length; i++) {
+        if (nearby[i].updatePing(mouseX, mouseY)) {
           setRemoving(true);
-        } else {
           break;
         }
       }
-      console.log("-------");
     };
   };
 
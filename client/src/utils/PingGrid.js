@@ -0,0 +1,53 @@
+// Buckets pings into square cells of their location, so finding the pings near a point
+// only looks at the cells around it instead of every ping
+class PingGrid {
+  constructor(cellSize) {
+    this.cellSize = cellSize;
+    this.cells = new Map();
+  }
+
+  key = (cellX, cellY) => {
+    return cellX + "," + cellY;
+  };
+
+  cellOf = (x, y) => {
+    return [Math.floor(x / this.cellSize), Math.floor(y / this.cellSize)];
+  };
+
+  add = (ping) => {
+    let key = this.key(...this.cellOf(ping.location[0], ping.location[1]));
+    if (!this.cells.has(key)) {
+      this.cells.set(key, new Set());
+    }
+    this.cells.get(key).add(ping);
+  };
+
+  remove = (ping) => {
+    let key = this.key(...this.cellOf(ping.location[0], ping.location[1]));
+    let cell = this.cells.get(key);
+    if (cell) {
+      cell.delete(ping);
+      if (cell.size === 0) {
+        this.cells.delete(key);
+      }
+    }
+  };
+
+  // Pings in the cell of (x, y) and the 8 around it, which holds every ping
+  // within cellSize of the point
+  near = (x, y) => {
+    let [cellX, cellY] = this.cellOf(x, y);
+    let found = [];
+    for (let dx = -1; dx <= 1; dx++) {
+      for (let dy = -1; dy <= 1; dy++) {
+        let cell = this.cells.get(this.key(cellX + dx, cellY + dy));
+        if (cell) {
+          found.push(...cell);
+        }
+      }
+    }
+    return found;
+  };
+}
+
+export default PingGrid;
@@ -1,6 +1,6 @@
-import { pingData } from "./testData";
 import { updatePingCoordinates } from "./utils";
 const SCALING_CONSTANT = 20;
+const HIT_RADIUS = 30; // Clicks this close to a ping, after scaling, hit it
 
 class Pings {
   constructor(id, location, active) {
@@ -21,7 +21,7 @@ class Pings {
 
   updatePing = (mouseX, mouseY) => {
     let d = this.dist(mouseX, mouseY, this.location[0], this.location[1]);
-    if (d <= 30) {
+    if (d <= HIT_RADIUS) {
       let data = updatePingCoordinates(this.id);
       return true
     }
@@ -33,11 +33,9 @@ class Pings {
     y2 = y2 * SCALING_CONSTANT
     var a = x1 - x2;
     var b = y1 - y2;
-    console.log(x1, y1);
-    console.log(x2, y2);
-    console.log(Math.sqrt(a * a + b * b));
     return Math.sqrt(a * a + b * b);
   };
 }
 
+export { SCALING_CONSTANT, HIT_RADIUS };
 export default Pings;
@@ -1,8 +1,5 @@
-let pingData = {
-  ping: [
-
-  ],
-};
+// Pings received from the server, keyed by id
+let pingData = new Map();
 
 let wallData = [
   {
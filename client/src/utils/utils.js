@@ -1,47 +1,57 @@
 import axios from "axios";
 import { pingData, wallData, pipeData } from "./testData";
-import Pings from "./Pings";
+import Pings, { SCALING_CONSTANT, HIT_RADIUS } from "./Pings";
+import PingGrid from "./PingGrid";
+
+// Index of the pings in pingData by location, for finding the one clicked
+const pingGrid = new PingGrid(HIT_RADIUS / SCALING_CONSTANT);
 
 
 const pingCoordinates = async () => {
-  let pingArray = [];
   // GET request here
-  axios
-    .get("http://127.0.0.1:5000/data", {
+  let response;
+  try {
+    response = await axios.get("http://127.0.0.1:5000/data", {
       headers: {
         "Content-Type": "application/json",
         Accept: "application/json"
       },
-    })
-    .then((response) => {
-      console.log(response)
-      for (let i = 0; i < response.data.ping.length; i++) {
-        if (pingData.ping.map((i) => {return i.id}).includes(response.data.ping[i].id)) {
-          console.log("PING ALREADY ADDED");
-        } else {
-          console.log("PING NOT ADDED, ADDING");
-          pingData.ping.push({
-            active: response.data.ping[i].active,
-            id: response.data.ping[i].id,
-            location: [response.data.ping[i].location[0], -response.data.ping[i].location[1]]
-          })
-        }
-      }
-
-
-      // active: true, id: 1, location: [-0.8200934540456766, 1.8]}
     });
+  } catch (error) {
+    console.log(error);
+    return Array.from(pingData.values());
+  }
 
-  // CREATES PING OBJECT AND ADDS TO ARRAY
-  for (let i = 0; i < pingData.ping.length; i++) {
-    let id = pingData.ping[i].id;
-    let location = pingData.ping[i].location;
-    let active = pingData.ping[i].active;
-    let ping = new Pings(id, location, active);
-    pingArray.push(ping);
+  // UPDATES PINGS IN PLACE, ONLY NEW ONES GET A PING OBJECT
+  let received = new Set();
+  for (const data of response.data.ping) {
+    received.add(data.id);
+    let ping = pingData.get(data.id);
+    if (ping === undefined) {
+      ping = new Pings(data.id, [data.location[0], -data.location[1]], data.active);
+      pingData.set(data.id, ping);
+      pingGrid.add(ping);
+    } else {
+      // a ping clicked here stays inactive even if the server has not seen the click yet
+      ping.active = ping.active && data.active;
+    }
   }
-  console.log(pingArray);
-  return pingArray;
+
+  // pings the server no longer sends have been archived
+  for (const [id, ping] of pingData) {
+    if (!received.has(id)) {
+      pingData.delete(id);
+      pingGrid.remove(ping);
+    }
+  }
+  return Array.from(pingData.values());
+};
+
+// Active pings that may be within a click of (mouseX, mouseY), in the scaled coordinates Pings.updatePing takes
+const pingsNear = (mouseX, mouseY) => {
+  return pingGrid
+    .near(mouseX / SCALING_CONSTANT, mouseY / SCALING_CONSTANT)
+    .filter((ping) => ping.active);
 };
 
 const wallCoordinates = async () => {
@@ -55,12 +65,12 @@ const pipeCoordinates = async () => {
 }
 
 const updatePingCoordinates = (pingId) => {
-  let pingIndex = pingData.ping.findIndex((ping) => ping.id == pingId);
-  console.log(pingIndex);
+  let ping = pingData.get(pingId);
+  if (ping === undefined) {
+    return;
+  }
   // SEND POST REQUEST HERE
-  pingData.ping[pingIndex].active = false;
-  // Send POST request here
-  console.log("changed");
+  ping.active = false;
 };
 
 export {
@@ -68,4 +78,5 @@ export {
   wallCoordinates,
   updatePingCoordinates,
   pipeCoordinates,
+  pingsNear,
 };
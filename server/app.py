@@ -1,10 +1,15 @@
 import os
 import json
+import atexit
+from numbers import Real
 from flask import Flask, flash, redirect, render_template, request, session, jsonify, Response
 from flask_session import Session
 from tempfile import mkdtemp
 from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
 from datetime import datetime
+from telemetry import TrackStore
+from pings import PingStore
+from ingest import IngestQueue
 
 #from helpers import apology, login_required, lookup
 
@@ -38,7 +43,15 @@ Session(app)
 #  },
 #  ...
 #]}
-ping_dict={"ping":[]}
+#Only recent pings are kept here, old inactive ones are archived to disk, see pings.py
+ping_store=PingStore(os.path.join(os.path.dirname(__file__), "archive"))
+#New pings are queued and added to ping_store in batches by one writer thread, see ingest.py
+ingest=IngestQueue(ping_store)
+atexit.register(ingest.close)
+
+
+def valid_location(location):
+    return isinstance(location, list) and len(location)==2 and all(isinstance(v, Real) for v in location)
 
 
 @app.route('/', methods=["GET", "POST"])
@@ -49,29 +62,82 @@ def index():
 
 @app.route('/ping-add', methods=["GET", "POST"])
 def ping_add():#data: dict):
-    """Add ping data to json file and return it"""
-    print(request.json)
+    """Queue a ping posted as {"location": [x, y]} and return its id, it shows up in /data within moments"""
     if request.method == "POST":
+        location=request.json.get("location")
+        if not valid_location(location):
+            return {"error": "location must be [x, y]"}, 400
+
+        #the ping gets the next id right away, the writer adds it to the store with the rest of its batch
+        return {"id": ingest.submit([location])[0]}
+
+
 
-        #first find id 
-        count=1+len(ping_dict["ping"])
-        #create the json object to be added
-        temp={"id": count, "location": request.json["location"], "active": True}
-        ping_dict["ping"].append(temp)
+#Last sequence number added from each outbox, so batches resent after a crash are not added twice
+outbox_seqs={}
 
-        return ping_dict
 
+@app.route('/ping-add-batch', methods=["POST"])
+def ping_add_batch():
+    """Add a batch of pings from a sim outbox and return the sequence numbers acknowledged"""
+    source=request.json["source"]
+    acked=[]
+    locations=[]
+    for item in request.json["pings"]:
+        if item["seq"]>outbox_seqs.get(source, 0):
+            #malformed pings are acknowledged and dropped, resending them would never help
+            if valid_location(item["location"]):
+                locations.append(item["location"])
+            outbox_seqs[source]=item["seq"]
+        acked.append(item["seq"])
+    ingest.submit(locations)
+    return {"acked": acked}
+
+
+#Drone position history, see telemetry.py
+tracks=TrackStore()
+
+
+@app.route('/telemetry', methods=["GET", "POST"])
+def telemetry():
+    """POST a batch of samples {"drones": {drone_id: [[t, x, y, vx, vy], ...]}}, or GET each drone's latest sample"""
+    if request.method == "POST":
+        accepted=0
+        for drone_id, samples in request.json["drones"].items():
+            accepted+=tracks.add_samples(drone_id, samples)
+        return {"accepted": accepted}
+
+    resp = jsonify(tracks.latest())
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
+
+
+@app.route('/telemetry/<drone_id>', methods=["GET"])
+def telemetry_track(drone_id):
+    """Return a drone's track, optional query args: resolution (seconds per point), start, end (sim time)"""
+    start=request.args.get("start", type=float)
+    end=request.args.get("end", type=float)
+    result=tracks.query(drone_id, request.args.get("resolution", 0.0, type=float), start, end)
+    if result is None:
+        return {"error": "unknown drone"}, 404
+
+    resolution, points, breaks=result
+    #Raw points are [t, x, y, vx, vy], buckets are [t, count, x_mean, y_mean, x_min, x_max, y_min, y_max]
+    #breaks are indices into points where the sim went back in time and a new segment starts
+    resp = jsonify({"drone": drone_id, "resolution": resolution, "points": points, "breaks": breaks})
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
 
 
 @app.route('/ping-data', methods=["GET", "POST"])
-def ping_disable(ping_id):
-    print(ping_id)
-    """disable ping with this id"""
-    if request.method == "POST":    
-        for item in ping_dict["ping"]:
-            if item["id"]==ping_id:
-                item["active"]=False
-        return ping_dict
+def ping_disable():
+    """disable ping with the id posted as {"id": n}"""
+    if request.method == "POST":
+        #the ping may have been added moments ago and still be queued
+        ingest.wait([request.json["id"]])
+        if not ping_store.disable(request.json["id"]):
+            return {"error": "unknown ping"}, 404
+        return ping_store.pings()
 
 @app.route('/data', methods=["GET", "POST"])
 def get_pings():
@@ -79,12 +145,20 @@ def get_pings():
     if request.method == "GET":
         # return jsonify("values.txt")
         #return {"tetsing":"test"}
-        print(ping_dict)
-        resp = jsonify(ping_dict)
+        resp = jsonify(ping_store.pings())
         resp.headers['Access-Control-Allow-Origin'] = '*'
         return resp
 
 
+@app.route('/history', methods=["GET"])
+def ping_history():
+    """Return a page of archived pings, query args: cursor (from the last page), limit (default 100)"""
+    pings, cursor=ping_store.history(request.args.get("cursor"), min(request.args.get("limit", 100, type=int), 1000))
+    resp = jsonify({"ping": pings, "next": cursor})
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
+
+
 
 '''
 #version 1
@@ -0,0 +1,74 @@
+import queue
+import threading
+import time
+import traceback
+
+
+class IngestQueue:
+    """Adds pings to a PingStore from one writer thread, in groups.
+
+    Request threads only reserve ids and queue the pings, so adding one costs the same however busy
+    the store is. The writer takes whatever is queued, waiting up to MAX_WAIT seconds after the
+    first ping for more, up to MAX_BATCH, and adds them to the store in one go. Under heavy ingest
+    every batch is full and each write to the store is paid once per batch instead of once per ping.
+
+    A ping is only in the store once its batch is written, usually within MAX_WAIT. wait() blocks
+    until given pings are in, for requests that use a ping right after adding it
+    """
+
+    MAX_BATCH = 1000  # Most pings added to the store at once
+    MAX_WAIT = 0.01  # Seconds the writer waits for a batch to fill
+
+    def __init__(self, store):
+        self.store = store
+        self.queue = queue.Queue()
+        self.pending = set()  # Ids queued but not yet in the store
+        self.written = threading.Condition()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, locations):
+        """Queue an active ping at each location and return their ids"""
+        first = self.store.reserve_ids(len(locations))
+        ids = list(range(first, first + len(locations)))
+        with self.written:
+            self.pending.update(ids)
+        for ping_id, location in zip(ids, locations):
+            self.queue.put({"id": ping_id, "location": location, "active": True})
+        return ids
+
+    def wait(self, ping_ids=None, timeout=1.0):
+        """Wait until the given pings, or all queued ones if None, are in the store. Return False on timeout"""
+        with self.written:
+            if ping_ids is None:
+                return self.written.wait_for(lambda: not self.pending, timeout)
+            return self.written.wait_for(lambda: self.pending.isdisjoint(ping_ids), timeout)
+
+    def close(self):
+        """Write everything queued and stop the writer"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _write_loop(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.time() + IngestQueue.MAX_WAIT
+            while len(batch) < IngestQueue.MAX_BATCH:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [ping for ping in batch if ping is not None]
+
+            try:
+                self.store.add_batch(batch)
+            except Exception:
+                #Keep writing later batches, the store adds pings before compacting so these are in
+                traceback.print_exc()
+            finally:
+                with self.written:
+                    self.pending.difference_update(ping["id"] for ping in batch)
+                    self.written.notify_all()
@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+
+class PingStore:
+    """Leak pings, with old inactive ones moved out of memory into compressed archive segments.
+
+    The hot set holds every active ping and pings deactivated less than RETENTION seconds ago,
+    keyed by id. compact() moves the rest into a new segment, a gzipped JSON lines file in
+    archive_dir, so the hot set and everything served from it stay small however long the
+    server runs. Archived pings are read back a page at a time with history().
+
+    archive_dir/index.json lists the segments in the order they were written and the next ping
+    id, so ids keep counting up and the archive is still there after a restart
+    """
+
+    RETENTION = 24 * 60 * 60  # Seconds a deactivated ping stays in the hot set
+    COMPACT_INTERVAL = 60  # Seconds between compactions
+    SEGMENT_SIZE = 10000  # Most pings written to one segment
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.hot = {}
+        self.lock = threading.Lock()
+        self.last_compaction = time.time()
+
+        os.makedirs(archive_dir, exist_ok=True)
+        self.segments = []
+        self.next_id = 1
+        if os.path.exists(self._index_path()):
+            with open(self._index_path()) as file:
+                index = json.load(file)
+            self.segments = index["segments"]
+            self.next_id = index["next_id"]
+
+    def _index_path(self):
+        return os.path.join(self.archive_dir, "index.json")
+
+    def _write_index(self):
+        """Replace the index atomically, so a crash never leaves it half written"""
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump({"segments": self.segments, "next_id": self.next_id}, file)
+        os.replace(tmp, self._index_path())
+
+    def reserve_ids(self, count):
+        """Take count consecutive ids for pings added later with add_batch, return the first"""
+        with self.lock:
+            first = self.next_id
+            self.next_id += count
+            return first
+
+    def add_batch(self, pings):
+        """Add pings, whose ids came from reserve_ids, all under one lock"""
+        with self.lock:
+            for ping in pings:
+                self.hot[ping["id"]] = ping
+        self.maybe_compact()
+
+    def disable(self, ping_id):
+        """Mark a ping inactive, return False if it is not in the hot set"""
+        with self.lock:
+            ping = self.hot.get(ping_id)
+            if ping is None:
+                return False
+            if ping["active"]:
+                ping["active"] = False
+                ping["deactivated_at"] = time.time()
+        self.maybe_compact()
+        return True
+
+    def pings(self):
+        """Return the hot set in the {"ping": [...]} shape served to the dashboard"""
+        # The dashboard polls this, so pings get archived even while none are added or disabled
+        self.maybe_compact()
+        with self.lock:
+            return {"ping": list(self.hot.values())}
+
+    def maybe_compact(self):
+        if time.time() - self.last_compaction >= PingStore.COMPACT_INTERVAL:
+            self.compact()
+
+    def compact(self, now=None):
+        """Archive inactive pings deactivated more than RETENTION seconds before now, return how many"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.last_compaction = now
+            old = [ping for ping in self.hot.values()
+                   if not ping["active"] and ping["deactivated_at"] <= now - PingStore.RETENTION]
+            for start in range(0, len(old), PingStore.SEGMENT_SIZE):
+                chunk = old[start:start + PingStore.SEGMENT_SIZE]
+                name = "segment-{:06d}.jsonl.gz".format(len(self.segments) + 1)
+                tmp = os.path.join(self.archive_dir, name + ".tmp")
+                with gzip.open(tmp, "wt") as file:
+                    for ping in chunk:
+                        file.write(json.dumps(ping) + "\n")
+                os.replace(tmp, os.path.join(self.archive_dir, name))
+                self.segments.append({"name": name, "count": len(chunk), "archived_at": now,
+                                      "first_id": min(p["id"] for p in chunk), "last_id": max(p["id"] for p in chunk)})
+            if old:
+                # Only forget the pings once their segments and the index listing them are on disk
+                self._write_index()
+                for ping in old:
+                    del self.hot[ping["id"]]
+            return len(old)
+
+    @lru_cache(maxsize=4)
+    def _read_segment(self, name):
+        with gzip.open(os.path.join(self.archive_dir, name), "rt") as file:
+            return [json.loads(line) for line in file]
+
+    def history(self, cursor=None, limit=100):
+        """Return (pings, next cursor) for a page of up to limit archived pings, oldest archived
+        first. cursor is "segment:offset" from the previous page, None for the first. The next
+        cursor is None once the archive is exhausted"""
+        segment, offset = 0, 0
+        if cursor:
+            segment, offset = (int(part) for part in cursor.split(":"))
+        with self.lock:
+            segments = list(self.segments)
+
+        page = []
+        while segment < len(segments) and len(page) < limit:
+            pings = self._read_segment(segments[segment]["name"])
+            taken = pings[offset:offset + limit - len(page)]
+            page += taken
+            offset += len(taken)
+            if offset >= len(pings):
+                segment, offset = segment + 1, 0
+        next_cursor = "{}:{}".format(segment, offset) if segment < len(segments) else None
+        return page, next_cursor
@@ -0,0 +1,118 @@
+import threading
+from collections import deque
+
+
+class Track:
+    """Position history of one drone, kept at several resolutions in fixed size ring buffers.
+
+    Raw samples are kept as [t, x, y, vx, vy]. Each level of LEVELS also folds the samples into
+    time buckets of that many seconds, kept as [t, count, x_mean, y_mean, x_min, x_max, y_min, y_max],
+    so a long history can be served zoomed out without touching every sample. The finer a level,
+    the less time it covers before old entries fall off.
+
+    Sim time can go backwards, e.g. when the sim restores a snapshot. A sample older than the
+    latest starts a new segment, and entries are kept in the order they arrived, each tagged
+    with the segment it belongs to
+    """
+
+    RAW_CAPACITY = 10000
+    LEVELS = (1.0, 10.0, 60.0, 600.0)
+    LEVEL_CAPACITY = 5000
+
+    def __init__(self):
+        #Entries are (segment, entry) pairs
+        self.raw = deque(maxlen=Track.RAW_CAPACITY)
+        self.levels = [deque(maxlen=Track.LEVEL_CAPACITY) for _ in Track.LEVELS]
+        # Bucket still being filled on each level, or None
+        self.open_buckets = [None for _ in Track.LEVELS]
+        self.segment = 0
+
+    def add(self, sample):
+        """Add one [t, x, y, vx, vy] sample, starting a new segment if it is older than the latest"""
+        t, x, y = sample[0], sample[1], sample[2]
+        if self.raw and t < self.raw[-1][1][0]:
+            self._new_segment()
+        self.raw.append((self.segment, list(sample)))
+
+        for i, width in enumerate(Track.LEVELS):
+            bucket = self.open_buckets[i]
+            start = t - t % width
+            if bucket is not None and bucket[0] != start:
+                self.levels[i].append((self.segment, self._close(bucket)))
+                bucket = None
+            if bucket is None:
+                # Running sums for the means, finished off in _close
+                self.open_buckets[i] = [start, 1, x, y, x, x, y, y]
+            else:
+                bucket[1] += 1
+                bucket[2] += x
+                bucket[3] += y
+                bucket[4] = min(bucket[4], x)
+                bucket[5] = max(bucket[5], x)
+                bucket[6] = min(bucket[6], y)
+                bucket[7] = max(bucket[7], y)
+
+    def _new_segment(self):
+        """Close every open bucket, so none mixes samples from before and after time went back"""
+        for i, bucket in enumerate(self.open_buckets):
+            if bucket is not None:
+                self.levels[i].append((self.segment, self._close(bucket)))
+                self.open_buckets[i] = None
+        self.segment += 1
+
+    @staticmethod
+    def _close(bucket):
+        """Return a copy of bucket with its sums turned into means"""
+        closed = list(bucket)
+        closed[2] /= closed[1]
+        closed[3] /= closed[1]
+        return closed
+
+    def query(self, resolution=0.0, start=None, end=None):
+        """Return (level width, entries, breaks) between start and end, in the order they arrived.
+        breaks are the indices into entries where a new segment starts. Uses raw samples (width 0) if
+        resolution is 0 or well below the finest level, otherwise the finest level at least as coarse
+        as resolution"""
+        if resolution <= 0 or resolution < Track.LEVELS[0] / 10:
+            width, entries = 0.0, list(self.raw)
+        else:
+            i = next((i for i, w in enumerate(Track.LEVELS) if w >= resolution), len(Track.LEVELS) - 1)
+            width, entries = Track.LEVELS[i], list(self.levels[i])
+            if self.open_buckets[i] is not None:
+                entries.append((self.segment, self._close(self.open_buckets[i])))
+
+        entries = [(segment, e) for segment, e in entries
+                   if (start is None or e[0] >= start) and (end is None or e[0] <= end)]
+        breaks = [i for i in range(1, len(entries)) if entries[i][0] != entries[i - 1][0]]
+        return width, [e for _, e in entries], breaks
+
+    def last(self):
+        return self.raw[-1][1] if self.raw else None
+
+
+class TrackStore:
+    """Tracks of every drone reporting telemetry, safe to use from several request threads"""
+
+    def __init__(self):
+        self.tracks = {}
+        self.lock = threading.Lock()
+
+    def add_samples(self, drone_id, samples):
+        """Add a batch of [t, x, y, vx, vy] samples for a drone, return how many were given"""
+        with self.lock:
+            track = self.tracks.setdefault(drone_id, Track())
+            #Kept in the order sent, an earlier time than the last sample means the sim went back
+            for sample in samples:
+                track.add(sample)
+        return len(samples)
+
+    def query(self, drone_id, resolution=0.0, start=None, end=None):
+        with self.lock:
+            if drone_id not in self.tracks:
+                return None
+            return self.tracks[drone_id].query(resolution, start, end)
+
+    def latest(self):
+        """Return each drone's latest sample"""
+        with self.lock:
+            return {drone_id: track.last() for drone_id, track in self.tracks.items()}